@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模块提取基准测试
+- 用法：python bench.py <页面.htm | 录制存档.jsonl.gz> ... [--rounds N]
+- 首页对比：逐模块整页解析（旧做法）、html.parser 整页解析一次后共享、lxml 整页解析、
+  lxml + SoupStrainer 单次提取、流式提取（取齐所有模块即停止）、纯 lxml 选择器快速路径
+- 列表页对比：html.parser、lxml、纯 lxml 选择器快速路径
+- 输出每种方式的 ops/s、p50/p99 单页耗时与峰值内存，并校验各方式提取的条目与 html.parser 完全一致
+- 峰值内存有两列：Py 为 tracemalloc 统计的 Python 对象；RSS 为在独立子进程中提取一遍时常驻内存峰值的增量，
+  包括 lxml 在 C 层分配的树（需要 Linux 的 /proc，其他系统显示 -）
+- 有输出不一致时以非零状态退出，可直接在 CI 中比对录制的页面
+- python bench.py items [N]：N 个条目（默认 100 万）分别用 dict 与 Item 存放时的内存与建索引耗时
+"""
+
+import sys
+import gzip
+import json
+import time
+import base64
+import tracemalloc
+import multiprocessing
+from types import SimpleNamespace
+
+import lxml.html
+from bs4 import BeautifulSoup
+
+import njubs
+
+
+def load_corpus(paths):
+    """读取语料：HTML 文件或录制存档中状态为 200 的响应，返回 [(url, RawPage)]
+
+    HTML 文件没有地址，一律按首页地址解析链接。
+    """
+    pages = []
+    for path in paths:
+        if path.endswith(".gz"):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    if record["status"] == 200 and record["body"]:
+                        content = base64.b64decode(record["body"])
+                        pages.append((record["url"], njubs.RawPage(content, "utf-8")))
+        else:
+            with open(path, "rb") as f:
+                pages.append((njubs.URL, njubs.RawPage(f.read(), "utf-8")))
+    return pages
+
+
+# {模块id: 预编译规则}
+RULES = {rule.container: rule for rule in njubs.COMPILED_RULES.values()}
+
+
+def is_homepage(page):
+    """含有任一目标模块 div 的视为首页，其余（文章列表页）按列表页测试"""
+    return any(f'id="{module_id}"'.encode() in page.content for module_id in RULES)
+
+
+# --------------------------
+# 首页：{模块id: 条目}
+# --------------------------
+
+def extract_per_module(url, page):
+    """旧做法：每个模块各自完整解析一次页面"""
+    return {
+        module_id: njubs.extract_items(BeautifulSoup(page.content, "html.parser").find("div", id=module_id), rule)
+        for module_id, rule in RULES.items()
+    }
+
+
+def extract_shared(url, page):
+    """整页 html.parser 解析一次，所有模块共用"""
+    soup = njubs.parse_page(page)
+    return {module_id: njubs.extract_module(soup, module_id, rule) for module_id, rule in RULES.items()}
+
+
+def extract_lxml(url, page):
+    """整页 lxml 解析一次，所有模块共用"""
+    soup = BeautifulSoup(page.content, "lxml", from_encoding=page.encoding)
+    return {module_id: njubs.extract_module(soup, module_id, rule) for module_id, rule in RULES.items()}
+
+
+def extract_strained(url, page):
+    """lxml + SoupStrainer，只为目标 div 建树"""
+    divs = njubs.parse_modules(page, list(RULES))
+    return {module_id: njubs.extract_items(div, RULES[module_id]) for module_id, div in divs.items()}
+
+
+def extract_streamed(url, page, chunk_size=16 * 1024):
+    """按网络分块喂给流式提取器，取齐所有模块即停止"""
+    response = SimpleNamespace(url=url, headers={"Content-Type": f"text/html; charset={page.encoding}"})
+    extractor = njubs.ModuleStreamExtractor(RULES)
+    for offset in range(0, len(page.content), chunk_size):
+        if extractor.feed(response, page.content[offset:offset + chunk_size]):
+            break
+    return {module_id: njubs.extract_items(div, RULES[module_id]) for module_id, div in extractor.modules().items()}
+
+
+# --------------------------
+# 选择器快速路径：不建 BeautifulSoup 树，直接在 lxml 树上用 XPath 取值
+# 只实现默认规则（a[href] 条目、li 行、.news_meta 日期、title 属性），与 extract_items 输出一致
+# --------------------------
+
+_CLASS_XPATH = "(.//*[contains(concat(' ', normalize-space(@class), ' '), ' {} ')])[1]"
+_DATE_XPATH = _CLASS_XPATH.format(njubs.DEFAULT_RULE["date"].lstrip("."))
+
+
+def _text(node):
+    """等价于 BeautifulSoup 的 get_text(strip=True)"""
+    return "".join(s.strip() for s in node.itertext())
+
+
+def _parse_lxml(page):
+    parser = lxml.html.HTMLParser(encoding=page.encoding)
+    return lxml.html.document_fromstring(page.content, parser=parser)
+
+
+def fast_items(module, base):
+    if module is None:
+        return []
+    results = []
+    for node in module.iterdescendants("a"):
+        href = node.get("href")
+        title = _text(node)
+        href = njubs.canonicalize_url(href, base) if href else None
+        if not title or not href:
+            continue
+        fields = {"pos": len(results) + 1}
+        full_title = (node.get("title") or "").strip()
+        if full_title and full_title != title:
+            fields["full_title"] = full_title
+        row = next(node.iterancestors("li"), None)
+        date = (row if row is not None else node).xpath(_DATE_XPATH)
+        if date and _text(date[0]):
+            fields["date"] = njubs.normalize_date(_text(date[0]))
+        results.append(njubs.Item.make(title, href, **fields))
+    return results
+
+
+def extract_selector(url, page):
+    root = _parse_lxml(page)
+    found = {div.get("id"): div for div in root.iter("div") if div.get("id") in RULES}
+    return {module_id: fast_items(found.get(module_id), rule.base) for module_id, rule in RULES.items()}
+
+
+MODULE_EXTRACTORS = {
+    "per_module": extract_per_module,
+    "html.parser": extract_shared,
+    "lxml": extract_lxml,
+    "strained": extract_strained,
+    "streamed": extract_streamed,
+    "selector": extract_selector,
+}
+
+
+# --------------------------
+# 列表页：条目
+# --------------------------
+
+def list_html_parser(url, page):
+    return njubs.extract_list_items(njubs.parse_page(page), url)
+
+
+def list_lxml(url, page):
+    return njubs.extract_list_items(BeautifulSoup(page.content, "lxml", from_encoding=page.encoding), url)
+
+
+def list_selector(url, page):
+    root = _parse_lxml(page)
+    body = root.find("body")
+    return njubs.column_items([item for item in fast_items(body if body is not None else root, url) if item.id], url)
+
+
+LIST_EXTRACTORS = {
+    "html.parser": list_html_parser,
+    "lxml": list_lxml,
+    "selector": list_selector,
+}
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def _status_kib(field):
+    """/proc/self/status 中以 KiB 为单位的一项"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+
+
+def _rss_growth(extract, pages):
+    """在子进程中运行：提取一遍，返回常驻内存峰值（VmHWM）比开始时（VmRSS）多出的字节数；没有 /proc 时返回 None
+
+    先把峰值重置为当前值（clear_refs），导入模块时的峰值不计入。不用 ru_maxrss：
+    exec 会把 fork 出的父进程副本的峰值并进去，子进程一开始就带着父进程的峰值。
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        before = _status_kib("VmRSS")
+    except OSError:
+        return None
+    for url, page in pages:
+        extract(url, page)
+    return (_status_kib("VmHWM") - before) * 1024
+
+
+def peak_rss(extract, pages):
+    """每种方式各用一个新启动（spawn）的进程测量，不受本进程已分配内存与其他方式的影响"""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_rss_growth, (extract, pages))
+
+
+def measure(extract, pages, rounds):
+    """返回 (ops/s, p50 秒, p99 秒, Python 对象峰值字节, 常驻内存峰值增量字节)"""
+    samples = []
+    for _ in range(rounds):
+        for url, page in pages:
+            start = time.perf_counter()
+            extract(url, page)
+            samples.append(time.perf_counter() - start)
+    tracemalloc.start()
+    for url, page in pages:
+        extract(url, page)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return len(samples) / sum(samples), percentile(samples, 0.5), percentile(samples, 0.99), peak, peak_rss(extract, pages)
+
+
+def check_identical(extractors, pages):
+    """以第一种方式为基准，返回输出不一致的 [(方式, url)]"""
+    (_, reference), *others = extractors.items()
+    mismatches = []
+    for url, page in pages:
+        expected = reference(url, page)
+        mismatches += [(name, url) for name, extract in others if extract(url, page) != expected]
+    return mismatches
+
+
+def run_suite(title, extractors, pages, rounds):
+    if not pages:
+        return True
+    print(f"\n{title}：{len(pages)} 页，每种方式 {rounds} 轮")
+    print(f"{'方式':<12} {'ops/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'Py KiB':>9} {'RSS KiB':>9}")
+    for name, extract in extractors.items():
+        ops, p50, p99, peak, rss = measure(extract, pages, rounds)
+        rss = "-" if rss is None else f"{rss / 1024:.0f}"
+        print(f"{name:<12} {ops:9.1f} {p50 * 1000:9.2f} {p99 * 1000:9.2f} {peak / 1024:9.0f} {rss:>9}")
+    mismatches = check_identical(extractors, pages)
+    for name, url in mismatches:
+        print(f"输出不一致：{name} {url}")
+    if not mismatches:
+        print("各方式提取结果完全一致。")
+    return not mismatches
+
+
+def synthetic_items(n):
+    """生成 n 个 (标题, 地址, 日期)，地址形如真实的 WebPlus 文章链接"""
+    for i in range(n):
+        aid = 800000 + i
+        url = f"https://nubs.nju.edu.cn/c{aid % 256:x}/{aid % 255:x}/c{8895 + i % 5}a{aid}/page.htm"
+        yield f"商学院新闻标题 {i}", url, f"2026-{i % 12 + 1:02d}-{i % 28 + 1:02d}"
+
+
+def build_dicts(n):
+    return [{"title": title, "url": url, "pos": i % 10 + 1, "id": njubs.article_id(url), "date": date}
+            for i, (title, url, date) in enumerate(synthetic_items(n))]
+
+
+def build_items(n):
+    return [njubs.Item.make(title, url, pos=i % 10 + 1, date=date)
+            for i, (title, url, date) in enumerate(synthetic_items(n))]
+
+
+def bench_items(n=1_000_000):
+    """对比 dict 与 Item 存放 n 个条目的内存，以及按身份键建索引（diff_snapshots 的做法）的耗时"""
+    print(f"条目数：{n}")
+    for name, build, key in (
+        ("dict", build_dicts, lambda item: item["id"]),
+        ("Item", build_items, lambda item: item.key),
+    ):
+        tracemalloc.start()
+        items = build(n)
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        start = time.perf_counter()
+        index = {key(item): item for item in items}
+        elapsed = time.perf_counter() - start
+        print(f"{name:<6} 内存 {current / 2**20:8.1f} MiB（每条 {current / n:5.0f} B）  建索引 {elapsed * 1000:7.1f} ms")
+        del items, index
+
+
+def main(paths, rounds=5):
+    pages = load_corpus(paths)
+    if not pages:
+        print("没有可用的页面。")
+        return True
+    homepages = [(url, page) for url, page in pages if is_homepage(page)]
+    list_pages = [(url, page) for url, page in pages if not is_homepage(page)]
+    ok = run_suite("首页", MODULE_EXTRACTORS, homepages, rounds)
+    return run_suite("列表页", LIST_EXTRACTORS, list_pages, rounds) and ok
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["items"]:
+        bench_items(int(args[1]) if len(args) > 1 else 1_000_000)
+        sys.exit(0)
+    rounds = 5
+    if "--rounds" in args:
+        i = args.index("--rounds")
+        rounds = int(args[i + 1])
+        del args[i:i + 2]
+    if not args:
+        print(__doc__)
+        sys.exit(1)
+    sys.exit(0 if main(args, rounds) else 1)
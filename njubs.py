@@ -8,18 +8,45 @@
 
 import os
 import re
+import sys
+import io
+import gzip
+import base64
+import atexit
+import asyncio
+import functools
+import threading
 import json
+import sqlite3
+import codecs
+import hashlib
+import hmac
+import struct
+import zlib
 import time
+import random
 import smtplib
+import socket
 import requests
 from email.mime.text import MIMEText
 from email.header import Header
-from bs4 import BeautifulSoup
+from datetime import timedelta
+from bs4 import BeautifulSoup, SoupStrainer
 from subprocess import run
 import urllib3
+import soupsieve
+from lxml import etree
 from requests.adapters import HTTPAdapter
-from urllib3.util.ssl_ import create_urllib3_context
+from requests.compat import chardet
+from urllib3.connection import HTTPSConnection
+from urllib3.connectionpool import HTTPSConnectionPool
 import ssl
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit, urljoin, parse_qsl, urlencode
+from subprocess import TimeoutExpired
+from typing import NamedTuple
+from collections import deque
+from collections.abc import Mapping, Sequence
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -27,16 +54,127 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 # 配置区
 # --------------------------
 URL = "https://nubs.nju.edu.cn/main.htm"
-MODULE_IDS = {
-    "latest_updates": "wp_news_w46",   # 最新动态
-    "notices": "wp_news_w47",          # 通知公告
-    "events": "wp_news_w48",           # 活动预告
-    "procurement": "wp_news_w100",     # 招标采购
-    "viewpoints": "wp_news_w49",       # 商院视点
-    "announcements": "wp_news_w110",   # 公示信息
+
+# 模块提取规则的默认值
+# - page：模块所在页面；container：模块 div 的 id
+# - item：条目节点的 CSS 选择器（相对模块 div）
+# - row：条目所在行（如 WebPlus 的 li），日期、置顶标记等元数据与链接并列在行内
+# - title / url / full_title：相对条目节点的 CSS 选择器，"选择器@属性" 取属性值，
+#   空字符串表示条目节点本身，None 表示不提取；full_title 为未截断的完整标题
+# - date / pinned：相对所在行的选择器（不在行内时相对条目节点）；pinned 匹配到即视为置顶
+# - list：栏目的 WebPlus 列表页（list.htm、list2.htm ...），用于补抓从首页滚出的条目
+# - email_env：订阅该模块的收件人所在的环境变量
+DEFAULT_RULE = {
+    "page": URL,
+    "item": "a[href]",
+    "row": "li",
+    "title": "",
+    "url": "@href",
+    "full_title": "@title",
+    "date": ".news_meta",
+    "pinned": None,
+    "list": None,
 }
 
-SNAPSHOT_FILE = "nubs_snapshot.json"
+# 模块规则表：新增模块或站点只需在此添加一项
+MODULE_RULES = {name: {**DEFAULT_RULE, **rule} for name, rule in {
+    "latest_updates": {                # 最新动态
+        "container": "wp_news_w46",
+        "list": "https://nubs.nju.edu.cn/8895/list.htm",
+        "email_env": "EMAIL_TO_UPDATES",
+    },
+    "notices": {                       # 通知公告
+        "container": "wp_news_w47",
+        "list": "https://nubs.nju.edu.cn/8896/list.htm",
+        "email_env": "EMAIL_TO_NOTICES",
+    },
+    "events": {                        # 活动预告
+        "container": "wp_news_w48",
+        "list": "https://nubs.nju.edu.cn/8897/list.htm",
+        "email_env": "EMAIL_TO_EVENTS",
+    },
+    "procurement": {                   # 招标采购
+        "container": "wp_news_w100",
+        "list": "https://nubs.nju.edu.cn/56446/list.htm",
+        "email_env": "EMAIL_TO_PROCUREMENT",
+    },
+    "viewpoints": {                    # 商院视点
+        "container": "wp_news_w49",
+        "list": "https://nubs.nju.edu.cn/8898/list.htm",
+        "email_env": "EMAIL_TO_VIEWPOINTS",
+    },
+    "announcements": {                 # 公示信息
+        "container": "wp_news_w110",
+        "email_env": "EMAIL_TO_ANNOUNCEMENTS",
+    },
+}.items()}
+
+# 由规则表派生的视图
+MODULE_IDS = {name: rule["container"] for name, rule in MODULE_RULES.items()}
+# 抓取计划：{模块: 来源页面}，同一页面的模块共享一次下载与解析
+MODULE_PAGES = {name: rule["page"] for name, rule in MODULE_RULES.items()}
+MODULE_LIST_URLS = {name: rule["list"] for name, rule in MODULE_RULES.items() if rule["list"]}
+# 规范化链接时去掉的跟踪参数（utm_ 开头的参数一律去掉）
+TRACKING_PARAMS = {"spm", "from", "isappinstalled", "scene", "clicktime", "wxfrom", "share_token"}
+# 每个模块单次最多翻页数；每个模块记住的列表页条目数上限（只存文章 id）
+LIST_MAX_PAGES = int(os.getenv("LIST_MAX_PAGES", "5"))
+LIST_KNOWN_LIMIT = 500
+
+# 可选：抓取新增文章的详情页（完整标题、发布日期、正文摘要），每次运行最多抓取 ARTICLE_FETCH_LIMIT 篇
+FETCH_ARTICLES = os.getenv("FETCH_ARTICLES", "").strip() in ("1", "true", "yes")
+ARTICLE_FETCH_LIMIT = int(os.getenv("ARTICLE_FETCH_LIMIT", "20"))
+ARTICLE_PREVIEW_CHARS = 120
+
+# 快照文件，扩展名决定存储方式：.json 为单个 JSON 文件；.db / .sqlite 为 SQLite 历史库，
+# 除当前状态外还保留每个条目的首次/最后出现时间与全部变化事件；.jsonl 为只追加的事件日志，
+# 定期压缩出检查点（同名 .checkpoint.json）并换用新一代日志（上一代保留为 .prev），当前状态 = 检查点 + 其后的日志；
+# .bin 为紧凑的分段二进制快照，每个模块、每项元信息各占一段，读取时只解码用到的段
+SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", "nubs_snapshot.json")
+# 事件日志自上次检查点起累计多少条事件后压缩一次
+LOG_COMPACT_EVERY = int(os.getenv("LOG_COMPACT_EVERY", "500"))
+# 快照中保存页面/模块指纹等元信息的键（不是模块名）
+META_KEY = "_meta"
+# 条件请求校验信息（ETag / Last-Modified），与快照放在同一目录
+VALIDATORS_FILE = os.path.join(os.path.dirname(SNAPSHOT_FILE), "nubs_validators.json")
+# 各主机熔断状态，跨运行保存
+BREAKER_FILE = os.path.join(os.path.dirname(SNAPSHOT_FILE), "nubs_breaker.json")
+# 运行日志：发信前先记录各模块的变化并把新快照写入暂存文件（<快照>.next），之后逐个记录投递结果，
+# 用暂存快照替换正式快照并提交后标记完成；
+# 中途崩溃或推送失败时，下次运行从中断处继续，不重新抓取比对，也不重复发信。
+# 日志随快照提交，其中只有收件人的加盐哈希，不含邮箱地址与邮件正文
+JOURNAL_FILE = os.path.join(os.path.dirname(SNAPSHOT_FILE), "nubs_journal.json")
+# 同一封邮件最多尝试投递的次数（跨运行累计），超过后放弃并记录
+JOURNAL_MAX_ATTEMPTS = int(os.getenv("JOURNAL_MAX_ATTEMPTS", "5"))
+# 文章详情缓存，每篇文章只抓取一次
+ARTICLES_FILE = os.path.join(os.path.dirname(SNAPSHOT_FILE), "nubs_articles.json")
+# 共享连接池大小（每个主机保持的连接数）
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+# 并发抓取上限：总并发数与单个主机的并发数（单主机并发不应超过连接池大小）
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "16"))
+FETCH_PER_HOST = int(os.getenv("FETCH_PER_HOST", "4"))
+# 重试策略：指数退避 + 随机抖动，整次运行的重试总耗时不超过 RETRY_BUDGET 秒
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "3"))
+RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", "1.0"))
+RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX", "10.0"))
+RETRY_BUDGET = float(os.getenv("RETRY_BUDGET", "60"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# 超时：连接与读取分开设置；单个页面最多读取 MAX_PAGE_BYTES 字节
+CONNECT_TIMEOUT = float(os.getenv("CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("READ_TIMEOUT", "15"))
+MAX_PAGE_BYTES = int(os.getenv("MAX_PAGE_BYTES", str(5 * 1024 * 1024)))
+SMTP_TIMEOUT = 30
+# 整次运行的截止时间（秒），按比例分给抓取、比对、发信、推送投递结果、提交五个阶段
+RUN_DEADLINE = float(os.getenv("RUN_DEADLINE", "1200"))
+PHASE_SHARES = {"fetch": 0.5, "diff": 0.1, "email": 0.2, "journal": 0.05, "git": 0.15}
+# 录制 / 回放：设置后所有 HTTP 响应写入（或读自）该压缩存档，回放时不访问网络
+HTTP_RECORD = os.getenv("NUBS_RECORD", "")
+HTTP_REPLAY = os.getenv("NUBS_REPLAY", "")
+# 熔断：同一主机连续失败 BREAKER_THRESHOLD 次后，冷却期内直接跳过。冷却期从 BREAKER_COOLDOWN 秒起，
+# 冷却后试探仍失败的每次加倍，最长 BREAKER_COOLDOWN_MAX 秒；默认值长于工作流 30 分钟一次的运行间隔，
+# 熔断后至少跳过一次运行，而不是每次运行都去试探
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "3"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "3600"))
+BREAKER_COOLDOWN_MAX = float(os.getenv("BREAKER_COOLDOWN_MAX", "21600"))
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
 
 # 邮件配置（全局发件人）
@@ -44,112 +182,1987 @@ SMTP_HOST = "smtp.qq.com"
 SMTP_USER = os.getenv("SMTP_USER", "").strip()
 SMTP_PASS = os.getenv("SMTP_PASS", "").strip()
 EMAIL_FROM = os.getenv("EMAIL_FROM", "").strip()
+# 运行日志中收件人哈希的密钥，未设置时使用 SMTP 授权码（同为仓库机密，不随仓库公开）
+JOURNAL_SALT = os.getenv("JOURNAL_SALT", "").strip() or SMTP_PASS
 
 # 模块订阅配置（每个模块可独立订阅）
 MODULE_SUBSCRIPTIONS = {
-    "latest_updates": os.getenv("EMAIL_TO_UPDATES", ""),
-    "notices": os.getenv("EMAIL_TO_NOTICES", ""),
-    "events": os.getenv("EMAIL_TO_EVENTS", ""),
-    "procurement": os.getenv("EMAIL_TO_PROCUREMENT", ""),
-    "viewpoints": os.getenv("EMAIL_TO_VIEWPOINTS", ""),
-    "announcements": os.getenv("EMAIL_TO_ANNOUNCEMENTS", ""),
+    name: os.getenv(rule["email_env"], "") for name, rule in MODULE_RULES.items()
 }
 
 # 转换为 {模块: [邮箱列表]}
 for k, v in MODULE_SUBSCRIPTIONS.items():
     MODULE_SUBSCRIPTIONS[k] = [addr.strip() for addr in v.split(",") if addr.strip()]
 
+# 单次运行内的统计信息
+RUN_STATS = {
+    "requests": 0, "saved_requests": 0, "not_modified": 0,
+    "pages_unchanged": 0, "modules_skipped": 0, "pages_failed": 0, "list_pages": 0,
+    "streams_stopped": 0, "bytes_read": 0,
+    "retries": 0, "retry_time": 0.0, "breaker_rejected": 0, "deadline_cut": 0,
+    "connections": 0, "reused_connections": 0, "connect_time": 0.0,
+    "tls_full": 0, "tls_full_time": 0.0, "tls_resumed": 0, "tls_resumed_time": 0.0,
+}
+_STATS_LOCK = threading.Lock()
+
+def add_stat(key, value=1):
+    """累加统计项（并发抓取时由多个线程调用）"""
+    with _STATS_LOCK:
+        RUN_STATS[key] += value
+
 # --------------------------
 # 自定义 TLSAdapter 解决 SSL 问题
 # --------------------------
-class TLSAdapter(HTTPAdapter):
-    def init_poolmanager(self, *args, **kwargs):
-        ctx = create_urllib3_context()
+class _ResumableSSLContext(ssl.SSLContext):
+    """按主机缓存 TLS 会话，新连接优先尝试会话复用，并分别记录完整握手与复用握手的耗时"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self._sessions = {}
+
+    def remember_session(self, host, sock):
+        if isinstance(sock, ssl.SSLSocket) and sock.session is not None:
+            self._sessions[host] = sock.session
+
+    def wrap_socket(self, sock, *args, server_hostname=None, session=None, **kwargs):
+        if session is None:
+            session = self._sessions.get(server_hostname)
+        start = time.perf_counter()
+        try:
+            ssock = super().wrap_socket(sock, *args, server_hostname=server_hostname,
+                                        session=session, **kwargs)
+        except ssl.SSLError:
+            # 握手失败后这条连接的 TLS 状态已不可用，不能在同一套接字上重试；
+            # 丢弃缓存的会话，由上层重试时新建连接完整握手
+            if session is not None:
+                self._sessions.pop(server_hostname, None)
+            raise
+        elapsed = time.perf_counter() - start
+        kind = "tls_resumed" if ssock.session_reused else "tls_full"
+        add_stat(kind)
+        add_stat(kind + "_time", elapsed)
+        self.remember_session(server_hostname, ssock)
+        return ssock
+
+# 进程内共享的 SSL 上下文，首次使用时创建
+_SSL_CONTEXT = None
+
+def get_ssl_context():
+    """兼容学院服务器的宽松 TLS 配置（SECLEVEL=1，不校验证书），允许会话票据以便复用"""
+    global _SSL_CONTEXT
+    if _SSL_CONTEXT is None:
+        ctx = _ResumableSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        ctx.minimum_version = ssl.TLSVersion.TLSv1_2
         ctx.set_ciphers("DEFAULT@SECLEVEL=1")
-        ctx.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+        ctx.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3 | ssl.OP_NO_COMPRESSION
+        ctx.options &= ~ssl.OP_NO_TICKET
         ctx.check_hostname = False
         ctx.verify_mode = ssl.CERT_NONE
-        kwargs["ssl_context"] = ctx
-        return super().init_poolmanager(*args, **kwargs)
+        _SSL_CONTEXT = ctx
+    return _SSL_CONTEXT
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    """记录建连（TCP + TLS 握手）耗时与连接复用次数"""
+
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        add_stat("connections")
+        add_stat("connect_time", time.perf_counter() - start)
+        self._nubs_used = False
+
+    def request(self, *args, **kwargs):
+        if getattr(self, "_nubs_used", False):
+            add_stat("reused_connections")
+        self._nubs_used = True
+        return super().request(*args, **kwargs)
+
+    def getresponse(self, *args, **kwargs):
+        # 响应要求关闭连接（Connection: close、HTTP/1.0）时，返回前 self.sock 已被置空，先留住套接字
+        sock = self.sock
+        response = super().getresponse(*args, **kwargs)
+        # TLS 1.3 的会话票据在握手后才送达，读到响应头时再记录一次
+        if isinstance(self.ssl_context, _ResumableSSLContext):
+            self.ssl_context.remember_session(self.host, sock)
+        return response
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class TLSAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["ssl_context"] = get_ssl_context()
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            **self.poolmanager.pool_classes_by_scheme,
+            "https": _TimedHTTPSConnectionPool,
+        }
 
     def proxy_manager_for(self, *args, **kwargs):
-        ctx = create_urllib3_context()
-        ctx.set_ciphers("DEFAULT@SECLEVEL=1")
-        ctx.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
-        kwargs["ssl_context"] = ctx
+        kwargs["ssl_context"] = get_ssl_context()
         return super().proxy_manager_for(*args, **kwargs)
 
-def get_page(url: str, timeout: int = 15) -> str:
-    headers = {"User-Agent": USER_AGENT}
-    s = requests.Session()
-    s.mount("http://", HTTPAdapter(max_retries=3))
-    s.mount("https://", TLSAdapter(max_retries=3))
+# 进程内共享的 HTTP 会话
+_SESSION = None
+
+def get_session():
+    """返回进程内共享的会话，所有抓取（首页、列表页、文章页）复用同一连接池"""
+    global _SESSION
+    if _SESSION is None:
+        s = requests.Session()
+        s.headers["User-Agent"] = USER_AGENT
+        pool = {"pool_connections": HTTP_POOL_SIZE, "pool_maxsize": HTTP_POOL_SIZE}
+        # 重试由 get_page_raw 按 RETRY_* 策略处理
+        s.mount("http://", HTTPAdapter(max_retries=0, **pool))
+        s.mount("https://", TLSAdapter(max_retries=0, **pool))
+        _SESSION = s
+    return _SESSION
+
+def close_session():
+    global _SESSION
+    if _SESSION is not None:
+        _SESSION.close()
+        _SESSION = None
+
+atexit.register(close_session)
+
+# 页面未修改（304）标记
+NOT_MODIFIED = object()
+
+# 各 URL 的条件请求校验信息 {url: {"etag": ..., "last_modified": ...}}
+_VALIDATORS = {}
+
+def write_atomic(path, data, keep_previous=False):
+    """崩溃安全地写文件：先写临时文件并 fsync，再原子替换
+
+    任何时刻磁盘上要么是完整的旧文件，要么是完整的新文件。
+    keep_previous 为真时把被替换的旧文件保留为 <path>.prev，供读取时回退。
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    if keep_previous and os.path.exists(path):
+        os.replace(path, f"{path}.prev")
+    os.replace(tmp, path)
     try:
-        r = s.get(url, headers=headers, timeout=timeout, verify=False, allow_redirects=True)
-        r.raise_for_status()
-        r.encoding = r.apparent_encoding
-        return r.text
-    except requests.exceptions.RequestException as e:
-        print("抓取失败：", e)
-        return ""
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)  # 让重命名本身也落盘
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+def write_json(path, data, keep_previous=False, **kwargs):
+    write_atomic(path, json.dumps(data, ensure_ascii=False, **kwargs).encode("utf-8"), keep_previous)
+
+def load_validators(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            _VALIDATORS.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+
+def save_validators(path):
+    write_json(path, _VALIDATORS, indent=2)
+
+class RawPage(NamedTuple):
+    """未解码的页面内容及其字符集；内容为空（抓取失败）时为假"""
+    content: bytes
+    encoding: str
+
+    def __bool__(self):
+        return bool(self.content)
+
+# 各主机已确定的字符集 {host: encoding}
+_HOST_CHARSETS = {}
+
+_HEADER_CHARSET_RE = re.compile(r"charset=[\"']?([\w.:-]+)", re.I)
+_META_CHARSET_RE = re.compile(rb"<meta[^>]+charset=[\"']?([\w.:-]+)", re.I)
+
+# 中文站点常见的字符集声明统一为其超集
+_CHARSET_ALIASES = {"gb2312": "gb18030", "gbk": "gb18030"}
+
+def _normalize_charset(name):
+    if isinstance(name, bytes):
+        name = name.decode("ascii", "ignore")
+    try:
+        name = codecs.lookup(name).name
+    except (LookupError, TypeError):
+        return None
+    return _CHARSET_ALIASES.get(name, name)
+
+def detect_encoding(r, content):
+    """确定响应的字符集：HTTP 头 > <meta charset> > 该主机上次的结果 > 全文检测"""
+    host = urlsplit(r.url).hostname
+    match = _HEADER_CHARSET_RE.search(r.headers.get("Content-Type", ""))
+    encoding = match and _normalize_charset(match.group(1))
+    if not encoding:
+        match = _META_CHARSET_RE.search(content[:4096])
+        encoding = match and _normalize_charset(match.group(1))
+    if not encoding:
+        encoding = _HOST_CHARSETS.get(host)
+    if not encoding:
+        encoding = _normalize_charset(chardet.detect(content)["encoding"]) or "utf-8"
+    _HOST_CHARSETS[host] = encoding
+    return encoding
+
+# --------------------------
+# 超时与运行截止时间
+# --------------------------
+
+class RunDeadline:
+    """整次运行的截止时间，按 PHASE_SHARES 分给各阶段；前面阶段省下的时间按比例顺延给后续阶段"""
+
+    def __init__(self, total, shares=PHASE_SHARES):
+        self.end = time.monotonic() + total
+        self.shares = shares
+        self.phase = None
+        self.phase_end = self.end
+
+    def begin(self, phase):
+        now = time.monotonic()
+        names = list(self.shares)
+        rest = sum(self.shares[name] for name in names[names.index(phase):])
+        self.phase = phase
+        self.phase_end = now + max(0.0, self.end - now) * self.shares[phase] / rest
+
+    def remaining(self):
+        return max(0.0, self.phase_end - time.monotonic())
+
+# 当前运行的截止时间，未设置时不限时
+_DEADLINE = None
+
+def begin_phase(phase):
+    if _DEADLINE is not None and _DEADLINE.phase != phase:
+        _DEADLINE.begin(phase)
+
+def time_left():
+    """当前阶段剩余的秒数"""
+    return _DEADLINE.remaining() if _DEADLINE is not None else float("inf")
+
+class ResponseTooLarge(requests.exceptions.RequestException):
+    """响应体超过 MAX_PAGE_BYTES"""
+
+class DeadlineExceeded(requests.exceptions.RequestException):
+    """当前阶段的时间预算已用完"""
+
+def _abort_read(r, expired):
+    """阶段时间用完时由定时器线程调用：关闭连接的套接字，让阻塞在 recv 上的读取立即返回"""
+    expired.set()
+    sock = getattr(getattr(r.raw, "_connection", None), "sock", None)
+    if sock is None:
+        # 以关闭连接结束的响应不再挂在连接上，只能从 http.client 的底层文件取套接字
+        fp = getattr(getattr(r.raw, "_fp", None), "fp", None)
+        sock = getattr(getattr(fp, "raw", None), "_sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+def read_body(r, sink=None):
+    """分块读取响应体，超过 MAX_PAGE_BYTES 或阶段超时即中止
+
+    sink 为流式提取器时逐块喂给它，提取器表示已取到全部所需内容后即停止读取
+    （录制模式下仍读完整个响应，以保证存档完整）。
+    服务器迟迟不发数据时读取会阻塞在 recv 上，块间的检查无从执行，
+    因此另设定时器在阶段剩余时间耗尽时关闭套接字。
+    """
+    if sink is not None:
+        sink.reset()
+    chunks, size = [], 0
+    expired = threading.Event()
+    timer = None
+    if time_left() != float("inf"):
+        timer = threading.Timer(max(time_left(), 0), _abort_read, (r, expired))
+        timer.daemon = True
+        timer.start()
+    try:
+        for chunk in r.iter_content(16 * 1024):
+            size += len(chunk)
+            if size > MAX_PAGE_BYTES:
+                raise ResponseTooLarge(f"响应超过 {MAX_PAGE_BYTES} 字节：{r.url}", response=r)
+            if expired.is_set() or time_left() <= 0:
+                raise DeadlineExceeded(f"抓取阶段超时：{r.url}", response=r)
+            chunks.append(chunk)
+            if sink is not None and sink.feed(r, chunk) and not HTTP_RECORD:
+                add_stat("streams_stopped")
+                break
+    except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError,
+            urllib3.exceptions.HTTPError, OSError) as e:
+        if expired.is_set():
+            raise DeadlineExceeded(f"抓取阶段超时：{r.url}", response=r) from e
+        raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+    # 没有 Content-Length 的响应以连接关闭为结束，被定时器关闭时看起来像正常读完
+    if expired.is_set():
+        raise DeadlineExceeded(f"抓取阶段超时：{r.url}", response=r)
+    add_stat("bytes_read", size)
+    return b"".join(chunks)
+
+# --------------------------
+# 重试与熔断
+# --------------------------
+
+# 各主机熔断状态 {host: {"failures": 连续失败次数, "opened_at": 熔断开始时间, "opens": 连续熔断次数}}
+_BREAKERS = {}
+_BREAKERS_SAVED = None
+_BREAKER_LOCK = threading.Lock()
+
+def load_breakers(path):
+    global _BREAKERS_SAVED
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            _BREAKERS.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    _BREAKERS_SAVED = json.dumps(_BREAKERS, sort_keys=True)
+
+def save_breakers(path):
+    """熔断状态有变化时写入文件，返回是否写入"""
+    global _BREAKERS_SAVED
+    state = json.dumps(_BREAKERS, sort_keys=True)
+    if state == _BREAKERS_SAVED:
+        return False
+    write_json(path, _BREAKERS, indent=2)
+    _BREAKERS_SAVED = state
+    return True
+
+def breaker_cooldown(state):
+    """本次熔断的冷却时间：每连续熔断一次加倍"""
+    return min(BREAKER_COOLDOWN_MAX, BREAKER_COOLDOWN * 2 ** (state.get("opens", 1) - 1))
+
+def breaker_allows(host):
+    """熔断打开且未过冷却期时拒绝请求；冷却期过后放行（半开），由下次结果决定开合"""
+    with _BREAKER_LOCK:
+        state = _BREAKERS.get(host)
+        if not state or state["failures"] < BREAKER_THRESHOLD:
+            return True
+        return time.time() - state["opened_at"] >= breaker_cooldown(state)
+
+def record_success(host):
+    with _BREAKER_LOCK:
+        _BREAKERS.pop(host, None)
+
+def record_failure(host):
+    with _BREAKER_LOCK:
+        state = _BREAKERS.setdefault(host, {"failures": 0, "opened_at": 0})
+        state["failures"] += 1
+        if state["failures"] >= BREAKER_THRESHOLD:
+            state["opened_at"] = time.time()
+            state["opens"] = state.get("opens", 0) + 1
+            print(f"{host} 连续失败 {state['failures']} 次，熔断 {breaker_cooldown(state):.0f} 秒")
+
+def backoff_delay(attempt):
+    """第 attempt 次重试前的等待时间：指数退避，全量随机抖动"""
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
+
+# --------------------------
+# 录制与回放
+# --------------------------
+# 存档为 gzip 压缩的 JSON Lines，每行一条响应：
+# {"url", "status", "headers", "elapsed", "time", "body"(base64)}
+
+_RECORD_FILE = None
+_RECORD_LOCK = threading.Lock()
+
+# 回放索引 {url: deque([记录, ...])}，同一 URL 的记录按录制顺序依次返回，最后一条重复使用
+_REPLAY = {}
+
+def load_archive(path):
+    """读取存档并建立按 URL 的回放索引"""
+    _REPLAY.clear()
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                _REPLAY.setdefault(record["url"], deque()).append(record)
+
+def archive_response(url, r, content):
+    """录制模式下把响应（含状态、头部与耗时）追加到存档，按请求的 URL 索引"""
+    global _RECORD_FILE
+    if not HTTP_RECORD:
+        return
+    record = {
+        "url": url,
+        "status": r.status_code,
+        "headers": dict(r.headers),
+        "elapsed": r.elapsed.total_seconds(),
+        "time": time.time(),
+        "body": base64.b64encode(content).decode("ascii"),
+    }
+    with _RECORD_LOCK:
+        if _RECORD_FILE is None:
+            _RECORD_FILE = gzip.open(HTTP_RECORD, "at", encoding="utf-8")
+            atexit.register(_RECORD_FILE.close)
+        _RECORD_FILE.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def _replay_response(url, headers):
+    """由存档记录构造 Response；存档中没有的 URL 按 404 处理"""
+    records = _REPLAY.get(url)
+    record = None
+    if records:
+        record = records.popleft() if len(records) > 1 else records[0]
+    r = requests.Response()
+    r.url = url
+    r.request = requests.Request("GET", url, headers=headers).prepare()
+    if record is None:
+        r.status_code = 404
+        r.raw = io.BytesIO(b"")
+        return r
+    r.status_code = record["status"]
+    r.headers = requests.structures.CaseInsensitiveDict(record["headers"])
+    r.elapsed = timedelta(seconds=record.get("elapsed", 0))
+    etag = r.headers.get("ETag")
+    if r.status_code == 200 and etag and headers.get("If-None-Match") == etag:
+        # 与真实服务器一致：校验信息匹配时返回 304
+        r.status_code = 304
+        r.raw = io.BytesIO(b"")
+    else:
+        r.raw = io.BytesIO(base64.b64decode(record["body"]))
+    return r
+
+def http_get(url, headers, timeout):
+    """发送 GET 请求（流式读取）；回放模式下从存档返回响应"""
+    if HTTP_REPLAY:
+        return _replay_response(url, headers)
+    return get_session().get(url, headers=headers, timeout=timeout,
+                             verify=False, allow_redirects=True, stream=True)
+
+def get_page(url: str, timeout=None, conditional: bool = False):
+    """抓取页面文本；conditional 为真时发送条件请求，304 返回 None"""
+    page = get_page_raw(url, timeout, conditional)
+    if page is None:
+        return None
+    return page.content.decode(page.encoding or "utf-8", errors="replace")
+
+def get_page_raw(url: str, timeout=None, conditional: bool = False, sink=None):
+    """抓取页面原始字节，返回 RawPage；304 返回 None，失败返回空的 RawPage
+
+    timeout 可为秒数或 (连接, 读取) 二元组，默认 (CONNECT_TIMEOUT, READ_TIMEOUT)，
+    并且不会超过当前阶段的剩余时间。sink 见 read_body；提前停止时只返回已读取的部分。
+    """
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    elif not isinstance(timeout, tuple):
+        timeout = (timeout, timeout)
+    headers = {}
+    if conditional:
+        saved = _VALIDATORS.get(url, {})
+        if saved.get("etag"):
+            headers["If-None-Match"] = saved["etag"]
+        if saved.get("last_modified"):
+            headers["If-Modified-Since"] = saved["last_modified"]
+    host = urlsplit(url).hostname
+    if not breaker_allows(host):
+        add_stat("breaker_rejected")
+        print(f"{host} 熔断中，跳过：{url}")
+        return RawPage(b"", None)
+
+    for attempt in range(RETRY_ATTEMPTS + 1):
+        left = time_left()
+        if left <= 0:
+            add_stat("deadline_cut")
+            print("抓取阶段超时，跳过：", url)
+            return RawPage(b"", None)
+        add_stat("requests")
+        started = time.monotonic()
+        try:
+            with http_get(url, headers, tuple(min(t, left) for t in timeout)) as r:
+                if r.status_code == 304:
+                    archive_response(url, r, b"")
+                    record_success(host)
+                    add_stat("not_modified")
+                    return None
+                if r.status_code >= 400:
+                    archive_response(url, r, b"")
+                r.raise_for_status()
+                content = read_body(r, sink)
+                archive_response(url, r, content)
+            record_success(host)
+            # 只有模块来源页会发条件请求；列表页、文章页的校验信息用不到，不保存
+            if url in MODULE_PAGES.values():
+                validators = {
+                    "etag": r.headers.get("ETag"),
+                    "last_modified": r.headers.get("Last-Modified"),
+                }
+                if any(validators.values()):
+                    _VALIDATORS[url] = validators
+                else:
+                    _VALIDATORS.pop(url, None)
+            return RawPage(content, detect_encoding(r, content))
+        except requests.exceptions.RequestException as e:
+            error = e
+            response = getattr(e, "response", None)
+            retryable = response is None or response.status_code in RETRY_STATUSES
+        if attempt:
+            add_stat("retry_time", time.monotonic() - started)
+        if isinstance(error, DeadlineExceeded):
+            add_stat("deadline_cut")
+            break
+        if not retryable:
+            # 服务器正常应答（如 404、响应过大），不计入熔断
+            record_success(host)
+            break
+        delay = backoff_delay(attempt)
+        if attempt == RETRY_ATTEMPTS or RUN_STATS["retry_time"] + delay > RETRY_BUDGET:
+            record_failure(host)
+            break
+        if delay >= time_left():
+            add_stat("deadline_cut")
+            break
+        add_stat("retries")
+        add_stat("retry_time", delay)
+        time.sleep(delay)
+    print("抓取失败：", error)
+    return RawPage(b"", None)
+
+# --------------------------
+# 并发抓取引擎
+# --------------------------
+
+async def fetch_pages_async(urls, fetch=None):
+    """并发抓取多个页面，返回 {url: fetch(url) 的结果}
+
+    同步的 fetch（默认 get_page）在线程池中执行，沿用共享会话与 TLSAdapter 的
+    TLS 配置；总并发受 FETCH_CONCURRENCY 限制，单个主机受 FETCH_PER_HOST 限制。
+    """
+    fetch = fetch or get_page
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return {}
+    loop = asyncio.get_running_loop()
+    total = asyncio.Semaphore(FETCH_CONCURRENCY)
+    per_host = {}
+
+    async def fetch_one(executor, url):
+        host = urlsplit(url).hostname
+        host_limit = per_host.setdefault(host, asyncio.Semaphore(FETCH_PER_HOST))
+        async with total, host_limit:
+            return url, await loop.run_in_executor(executor, fetch, url)
+
+    with ThreadPoolExecutor(max_workers=min(FETCH_CONCURRENCY, len(urls))) as executor:
+        results = await asyncio.gather(*(fetch_one(executor, url) for url in urls))
+    return dict(results)
+
+def fetch_pages(urls, fetch=None):
+    """fetch_pages_async 的同步封装"""
+    return asyncio.run(fetch_pages_async(urls, fetch))
 
 # --------------------------
 # 工具函数
 # --------------------------
 
-def fetch_module(module_id):
-    """抓取单个模块的文章列表"""
-    html = get_page(URL)
-    if not html:
-        return []
-    soup = BeautifulSoup(html, "html.parser")
-    module = soup.find("div", id=module_id)
+def parse_page(page):
+    """解析页面（RawPage 或文本）：304 返回 NOT_MODIFIED，抓取失败返回 None"""
+    if page is None:
+        return NOT_MODIFIED
+    if not page:
+        return None
+    if isinstance(page, RawPage):
+        # 直接解析原始字节，避免先解码成大字符串
+        return BeautifulSoup(page.content, "html.parser", from_encoding=page.encoding)
+    return BeautifulSoup(page, "html.parser")
+
+def parse_modules(page, module_ids):
+    """一次解析同时取出所有目标模块：lxml 解析，SoupStrainer 只为目标 div 建树
+
+    返回 {模块id: div 或 None}。
+    """
+    strainer = SoupStrainer("div", id=set(module_ids))
+    soup = BeautifulSoup(page.content, "lxml", parse_only=strainer, from_encoding=page.encoding)
+    found = {div.get("id"): div for div in soup.find_all("div", id=True, recursive=False)}
+    return {module_id: found.get(module_id) for module_id in module_ids}
+
+class ModuleStreamExtractor:
+    """流式提取模块：边下载边增量解析，每个目标 div 闭合时立即取出其 HTML 片段
+
+    所有目标模块都取到后 feed 返回 True，调用方据此停止读取网络流，
+    页脚、脚本等剩余部分既不下载也不解析。
+    """
+
+    def __init__(self, module_ids):
+        self.module_ids = set(module_ids)
+        self.reset()
+
+    def reset(self):
+        self.parser = None
+        self.pending = set(self.module_ids)
+        self.fragments = {}
+        self._inside = 0
+
+    def feed(self, r, chunk):
+        if self.parser is None:
+            self.parser = etree.HTMLPullParser(events=("start", "end"), encoding=detect_encoding(r, chunk))
+        self.parser.feed(chunk)
+        for event, el in self.parser.read_events():
+            is_target = el.tag == "div" and el.get("id") in self.pending
+            if event == "start":
+                self._inside += is_target
+                continue
+            if is_target:
+                module_id = el.get("id")
+                self.fragments[module_id] = etree.tostring(el, method="html", encoding="utf-8", with_tail=False)
+                self.pending.discard(module_id)
+                self._inside -= 1
+            if not self._inside:
+                # 目标模块之外已解析完的节点随即释放
+                el.clear(keep_tail=False)
+                while el.getprevious() is not None:
+                    del el.getparent()[0]
+        return not self.pending
+
+    def modules(self):
+        """返回 {模块id: div 或 None}"""
+        if not self.fragments:
+            return {module_id: None for module_id in self.module_ids}
+        page = RawPage(b"".join(self.fragments.values()), "utf-8")
+        return parse_modules(page, self.module_ids)
+
+def build_fetch_plan():
+    """按来源页面对模块分组：{url: [(模块名, 模块id), ...]}"""
+    plan = {}
+    for name, module_id in MODULE_IDS.items():
+        plan.setdefault(MODULE_PAGES.get(name, URL), []).append((name, module_id))
+    return plan
+
+def fingerprint(content):
+    """内容指纹，用于判断页面或模块片段是否与上次完全相同"""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+class CompiledRule(NamedTuple):
+    """预编译的模块规则；字段选择器为 (已编译选择器或 None, 属性名或 None)"""
+    container: str
+    base: str
+    item: soupsieve.SoupSieve
+    row: soupsieve.SoupSieve
+    title: tuple
+    url: tuple
+    full_title: tuple
+    date: tuple
+    pinned: tuple
+
+def _compile_field(spec):
+    if spec is None:
+        return None
+    selector, _, attr = spec.partition("@")
+    return (soupsieve.compile(selector) if selector else None, attr or None)
+
+def compile_rule(rule):
+    """编译模块规则，选择器只在启动时编译一次，之后各页面、各次运行复用"""
+    return CompiledRule(
+        container=rule.get("container", ""),
+        base=rule["page"],
+        item=soupsieve.compile(rule["item"]),
+        row=soupsieve.compile(rule["row"]) if rule["row"] else None,
+        title=_compile_field(rule["title"]),
+        url=_compile_field(rule["url"]),
+        full_title=_compile_field(rule["full_title"]),
+        date=_compile_field(rule["date"]),
+        pinned=_compile_field(rule["pinned"]),
+    )
+
+def _select_field(node, field):
+    """按字段选择器取值：属性值或文本；节点不存在时返回 None"""
+    selector, attr = field
+    if selector is not None:
+        node = selector.select_one(node)
+        if node is None:
+            return None
+    return node.get(attr) if attr else node.get_text(strip=True)
+
+_DATE_RE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})")
+
+def normalize_date(text):
+    """把 2024-3-5 之类的日期规范为 2024-03-05，便于按字符串排序比较；无完整日期时原样返回"""
+    match = _DATE_RE.search(text)
+    if not match:
+        return text.strip("[]【】() ")
+    year, month, day = match.groups()
+    return f"{year}-{int(month):02d}-{int(day):02d}"
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def canonicalize_url(href, base):
+    """按 RFC 3986 将链接相对 base 解析为绝对地址并规范化，非 http(s) 链接返回 None
+
+    协议与主机名转小写，去掉协议的默认端口、片段与跟踪参数；本站未指定端口的 http 链接统一为 https。
+    """
+    parts = urlsplit(urljoin(base, href.strip()))
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https") or not parts.hostname:
+        return None
+    host = parts.hostname
+    try:
+        # 只去掉与协议相符的默认端口，http://host:443 之类仍是不同的地址
+        port = parts.port if parts.port != _DEFAULT_PORTS[scheme] else None
+    except ValueError:  # 端口非法
+        return None
+    if scheme == "http" and host in _HTTPS_HOSTS and port is None:
+        scheme = "https"
+    if ":" in host:  # IPv6 地址需保留方括号
+        host = f"[{host}]"
+    netloc = f"{host}:{port}" if port else host
+    query = parts.query
+    if query:
+        params = parse_qsl(query, keep_blank_values=True)
+        kept = [(k, v) for k, v in params if k not in TRACKING_PARAMS and not k.startswith("utm_")]
+        if len(kept) != len(params):
+            query = urlencode(kept)
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+# WebPlus 文章链接，如 /c3/61/c8895a836449/page.htm，a 后的数字为全站唯一的文章 id
+_ARTICLE_URL_RE = re.compile(r"/c\d+a(\d+)/page\.htm")
+
+def article_id(url):
+    """WebPlus 文章 id（整数），非文章链接返回 None"""
+    match = _ARTICLE_URL_RE.search(url)
+    return int(match.group(1)) if match else None
+
+def url_key(url):
+    """比对用的身份键：WebPlus 文章取文章 id，其他链接取规范化地址"""
+    return article_id(url) or canonicalize_url(url, url) or url
+
+class Item(NamedTuple):
+    """文章条目，抓取、比对、存储各层通用
+
+    用元组而不是 dict 存放，每个条目省去一个哈希表；地址在 WebPlus 文章 id 处拆成
+    head / tail 两段并驻留，同一目录的条目共享同一个字符串对象，只单独保存整数 id。
+    非文章链接 id 为 0，整个地址存放在 head 中。pos（在模块中的位置，从 1 开始）为 0、
+    date / full_title 为空表示页面上没有这些信息。日期同样驻留，同一天的条目共用一个字符串。
+    """
+    title: str
+    head: str
+    id: int = 0
+    tail: str = ""
+    pos: int = 0
+    date: str = ""
+    full_title: str = ""
+    pinned: bool = False
+
+    @classmethod
+    def make(cls, title, url, **fields):
+        if fields.get("date"):
+            fields["date"] = sys.intern(fields["date"])
+        match = _ARTICLE_URL_RE.search(url)
+        if match and not match.group(1).startswith("0"):
+            head, tail = sys.intern(url[:match.start(1)]), sys.intern(url[match.end(1):])
+            return cls(title, head, int(match.group(1)), tail, **fields)
+        return cls(title, sys.intern(url), **fields)
+
+    @classmethod
+    def from_dict(cls, data):
+        fields = {k: data[k] for k in ("pos", "date", "full_title", "pinned") if k in data}
+        return cls.make(data["title"], data["url"], **fields)
+
+    def to_dict(self):
+        """快照文件中的 JSON 形式，与旧版本的条目格式兼容"""
+        data = {"title": self.title, "url": self.url}
+        if self.pos:
+            data["pos"] = self.pos
+        if self.id:
+            data["id"] = self.id
+        if self.full_title:
+            data["full_title"] = self.full_title
+        if self.date:
+            data["date"] = self.date
+        if self.pinned:
+            data["pinned"] = True
+        return data
+
+    @property
+    def url(self):
+        return f"{self.head}{self.id}{self.tail}" if self.id else self.head
+
+    @property
+    def key(self):
+        """比对用的身份键：WebPlus 文章取文章 id，其他链接取规范化地址"""
+        return self.id or url_key(self.head)
+
+    @property
+    def display_title(self):
+        return self.full_title or self.title
+
+def high_watermark(items, watermark=0):
+    """条目中最大的 WebPlus 文章 id 与已有水位线取大；文章 id 随发布递增，高于水位线的必为新文章"""
+    return max([watermark] + [item.id for item in items])
+
+# 快照元信息中存放条目的键
+_META_ITEM_KEYS = ("list_added",)
+
+def meta_to_json(key, value):
+    if key in _META_ITEM_KEYS:
+        return {module: [item.to_dict() for item in items] for module, items in value.items()}
+    return value
+
+def meta_from_json(key, value):
+    if key in _META_ITEM_KEYS:
+        return {module: [Item.from_dict(item) for item in items] for module, items in value.items()}
+    if key == "list_known":
+        # 旧版本记的是完整地址，读入时换成文章 id
+        return {
+            module: [aid for aid in (v if isinstance(v, int) else article_id(v) for v in known) if aid]
+            for module, known in value.items()
+        }
+    return value
+
+def snapshot_to_json(snapshot):
+    """快照转为 JSON 形式（条目为 dict），用于写文件"""
+    data = {}
+    for key, value in snapshot.items():
+        if key == META_KEY:
+            data[key] = {k: meta_to_json(k, v) for k, v in value.items()}
+        else:
+            data[key] = [item.to_dict() for item in value]
+    return data
+
+def json_item_key(item):
+    """JSON 形式条目的身份键（字符串），与 Item.key 对应"""
+    return str(item.get("id") or url_key(item["url"]))
+
+def snapshot_from_json(data):
+    snapshot = {}
+    for key, value in data.items():
+        if key == META_KEY:
+            snapshot[key] = {k: meta_from_json(k, v) for k, v in value.items()}
+        else:
+            snapshot[key] = [Item.from_dict(item) for item in value]
+    return snapshot
+
+def extract_module(soup, module_id, rule=None):
+    """从整页解析结果中提取单个模块的文章列表（基准测试中与单次提取对比用）"""
+    return extract_items(soup.find("div", id=module_id) if soup is not None else None, rule)
+
+def extract_items(module, rule=None, base=None):
+    """按模块规则从模块 div 中提取文章列表
+
+    条目为 Item，按页面内容附带 pos、full_title（title 属性中未截断的标题，
+    与显示标题相同时省略）、date 与 pinned。
+    链接按所在页面 base（默认为规则的来源页面）解析为规范化的绝对地址。
+    """
     if not module:
         return []
-    links = module.find_all("a", href=True)
+    rule = rule or DEFAULT_COMPILED_RULE
     results = []
-    for a in links:
-        title = a.get_text(strip=True)
-        href = a["href"]
-        if not href.startswith("http"):
-            href = "https://nubs.nju.edu.cn/" + href.lstrip("/")
-        if title:
-            results.append({"title": title, "url": href})
+    for node in rule.item.select(module):
+        title = _select_field(node, rule.title)
+        href = _select_field(node, rule.url)
+        href = canonicalize_url(href, base or rule.base) if href else None
+        if not title or not href:
+            continue
+        fields = {"pos": len(results) + 1}
+        if rule.full_title:
+            full_title = (_select_field(node, rule.full_title) or "").strip()
+            if full_title and full_title != title:
+                fields["full_title"] = full_title
+        row = rule.row.closest(node) if rule.row else None
+        if rule.date:
+            date = _select_field(row or node, rule.date)
+            if date:
+                fields["date"] = normalize_date(date)
+        if rule.pinned and _select_field(row or node, rule.pinned) is not None:
+            fields["pinned"] = True
+        results.append(Item.make(title, href, **fields))
+    return results
+
+DEFAULT_COMPILED_RULE = compile_rule(DEFAULT_RULE)
+COMPILED_RULES = {name: compile_rule(rule) for name, rule in MODULE_RULES.items()}
+# 统一使用 https 的站点：规则表中以 https 访问的主机
+_HTTPS_HOSTS = {urlsplit(rule["page"]).hostname for rule in MODULE_RULES.values() if rule["page"].startswith("https:")}
+
+def list_page_url(list_url, n):
+    """第 n 页列表页地址：list.htm、list2.htm、list3.htm ..."""
+    return list_url if n == 1 else re.sub(r"list\.htm$", f"list{n}.htm", list_url)
+
+_LIST_URL_RE = re.compile(r"/(\d+)/list\d*\.htm$")
+
+def column_items(items, list_url):
+    """只保留列表页所属栏目的文章（地址形如 /c<栏目 id>a<文章 id>/page.htm）
+
+    侧栏、“热点新闻”等部件中链到其他栏目的文章不算本模块的条目；地址中看不出栏目时全部保留。
+    """
+    match = _LIST_URL_RE.search(urlsplit(list_url).path)
+    if not match:
+        return items
+    suffix = f"/c{match.group(1)}a"
+    return [item for item in items if item.head.endswith(suffix)]
+
+def extract_list_items(soup, url):
+    """从列表页中提取本栏目的文章条目（按页面顺序，忽略导航、翻页链接与其他栏目的文章）"""
+    if soup is None or soup is NOT_MODIFIED:
+        return []
+    return column_items([item for item in extract_items(soup.body or soup, base=url) if item.id], url)
+
+def crawl_list(list_url, known, baseline=False, watermark=0, floor=0):
+    """依次翻阅列表页，返回其中所有新条目
+
+    每页整页扫描：文章 id 高于水位线 watermark（非 0）的，或既不在已知集合 known 中、
+    id 也不低于已知集合中最小 id（floor）的，都算新条目；置顶的旧条目排在最前，
+    不会挡住后面的新条目。某页没有新条目即视为已翻过已知范围，停止翻页，
+    最多 LIST_MAX_PAGES 页；已知集合因此只需保留最近的一段。
+    baseline 为真时只读第一页，返回其全部条目，用于首次建立已知集合。
+    """
+    results, seen = [], set()
+    for n in range(1, (1 if baseline else LIST_MAX_PAGES) + 1):
+        add_stat("list_pages")
+        page_url = list_page_url(list_url, n)
+        items = extract_list_items(parse_page(get_page_raw(page_url)), page_url)
+        fresh = 0
+        for item in items:
+            old = item.key in known or (item.id and item.id < floor)
+            if baseline or (watermark and item.id > watermark) or not old:
+                if item.key not in seen:
+                    seen.add(item.key)
+                    results.append(item)
+                    fresh += 1
+        if not fresh:
+            break
     return results
 
-def fetch_all_modules():
-    """抓取所有模块"""
+def known_keys(snapshot, name, homepage=True):
+    """模块已知条目的身份键：记住的列表页条目，homepage 为真时加上快照中的首页条目"""
+    known = set(snapshot.get(META_KEY, {}).get("list_known", {}).get(name, []))
+    if homepage:
+        known.update(item.key for item in snapshot.get(name, []))
+    return known
+
+def crawl_list_pages(names, old_snapshot, all_data):
+    """并发补抓各模块的列表页，返回 (已知条目 {模块: [文章 id]}, 新增条目 {模块: [条目]})
+
+    已知条目只取旧快照与上次记住的列表页条目，这样首页上刚出现的新条目不会让翻页提前停止；
+    补抓到但首页上没有的条目即为从首页滚出、需要补报的新条目。
+    """
+    old_known = old_snapshot.get(META_KEY, {}).get("list_known", {})
+    watermarks = old_snapshot.get(META_KEY, {}).get("watermarks", {})
+    jobs = {}
+    for name in names:
+        known = known_keys(old_snapshot, name)
+        floor = min((key for key in known if isinstance(key, int)), default=0)
+        jobs[MODULE_LIST_URLS[name]] = (name, known, name not in old_known, watermarks.get(name, 0), floor)
+    crawled = fetch_pages(jobs, lambda url: crawl_list(url, *jobs[url][1:]))
+
+    list_known, list_added = {}, {}
+    for url, (name, _, baseline, _, _) in jobs.items():
+        ids = [item.id for item in crawled[url]]
+        if baseline:
+            list_known[name] = ids[:LIST_KNOWN_LIMIT]
+            continue
+        on_homepage = {item.key for item in all_data.get(name, [])}
+        added = [item for item in crawled[url] if item.key not in on_homepage]
+        if added:
+            list_added[name] = added
+        list_known[name] = list(dict.fromkeys(ids + old_known[name]))[:LIST_KNOWN_LIMIT]
+    return list_known, list_added
+
+# --------------------------
+# 文章详情
+# --------------------------
+
+# 文章详情缓存 {url: {"title", "date", "preview", "fetched_at"}}
+_ARTICLES = {}
+
+def load_articles(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            _ARTICLES.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+
+def save_articles(path):
+    if _ARTICLES:
+        write_json(path, _ARTICLES, indent=2)
+
+def extract_article(soup):
+    """从 WebPlus 文章页提取完整标题、发布日期与正文摘要"""
+    title_node = soup.find(class_="arti_title") or soup.find("h1") or soup.title
+    meta_node = soup.find(class_="arti_update") or soup.find(class_="arti_metas")
+    content_node = soup.find(class_="wp_articlecontent") or soup.find(class_="entry") or soup.body
+    date = _DATE_RE.search(meta_node.get_text(" ", strip=True)) if meta_node else None
+    text = content_node.get_text(" ", strip=True) if content_node else ""
+    return {
+        "title": title_node.get_text(strip=True) if title_node else "",
+        "date": normalize_date(date.group(0)) if date else "",
+        "preview": text[:ARTICLE_PREVIEW_CHARS],
+    }
+
+def fetch_article(url):
+    """抓取单篇文章详情；失败返回 None"""
+    page = get_page_raw(url)
+    if not page:
+        return None
+    detail = extract_article(parse_page(page))
+    detail["fetched_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    return detail
+
+def fetch_article_details(diffs):
+    """为有订阅者的模块中新增的文章抓取详情，已缓存的文章不再请求；返回本次新抓取的篇数"""
+    urls = [
+        item.url
+        for module, info in diffs.items() if MODULE_SUBSCRIPTIONS.get(module)
+        for item in info["added"]
+        if item.id and item.url not in _ARTICLES
+    ]
+    urls = list(dict.fromkeys(urls))[:ARTICLE_FETCH_LIMIT]
+    for url, detail in fetch_pages(urls, fetch_article).items():
+        if detail:
+            _ARTICLES[url] = detail
+    return len(urls)
+
+def fetch_all_modules(old_snapshot=None):
+    """抓取所有模块：每个来源页面只请求一次，所有模块共用同一份解析结果
+
+    页面返回 304、整页指纹与上次相同或抓取失败时不解析，沿用旧快照中的条目；
+    模块片段指纹与上次相同时跳过链接提取。没有任何页面取得新内容时返回 None。
+    有变化的模块会再翻阅其列表页，补抓两次运行之间从首页滚出的新条目。
+    """
+    old_snapshot = old_snapshot or {}
+    old_meta = old_snapshot.get(META_KEY, {})
+    old_page_hashes = old_meta.get("page_hashes", {})
+    old_module_hashes = old_meta.get("module_hashes", {})
+    page_hashes, module_hashes = {}, {}
+    plan = build_fetch_plan()
+    # 旧快照缺少该页任一模块时必须完整抓取
+    conditional = {
+        url: all(name in old_snapshot for name, _ in modules)
+        for url, modules in plan.items()
+    }
+    extractors = {
+        url: ModuleStreamExtractor(module_id for _, module_id in modules)
+        for url, modules in plan.items()
+    }
+    pages = fetch_pages(plan, lambda url: get_page_raw(
+        url, conditional=conditional[url], sink=extractors[url]))
     all_data = {}
-    for name, module_id in MODULE_IDS.items():
-        all_data[name] = fetch_module(module_id)
+    modified = False
+    fresh = set()  # 本次重新提取的模块
+
+    def keep_old(url, modules):
+        """整页沿用上次结果（旧快照中没有的模块保持缺省）"""
+        if url in old_page_hashes:
+            page_hashes[url] = old_page_hashes[url]
+        for name, _ in modules:
+            if name in old_snapshot:
+                all_data[name] = old_snapshot[name]
+            if name in old_module_hashes:
+                module_hashes[name] = old_module_hashes[name]
+
+    for url, modules in plan.items():
+        # 同页其余模块若各自请求将多出的次数
+        add_stat("saved_requests", len(modules) - 1)
+        html = pages[url]
+        if html is not None and not html:
+            # 抓取失败：保留上次结果，避免被当作全部删除
+            add_stat("pages_failed")
+            keep_old(url, modules)
+            continue
+        page_hash = fingerprint(html.content) if html else None
+        if html is None or (conditional[url] and page_hash == old_page_hashes.get(url)):
+            # 304 或整页字节相同：不解析，整页模块沿用上次结果
+            if html is not None:
+                add_stat("pages_unchanged")
+            keep_old(url, modules)
+            add_stat("modules_skipped", len(modules))
+            continue
+
+        modified = True
+        if page_hash:
+            page_hashes[url] = page_hash
+        divs = extractors[url].modules()
+        for name, module_id in modules:
+            module = divs[module_id]
+            module_hash = fingerprint(str(module)) if module else None
+            if module_hash and module_hash == old_module_hashes.get(name) and name in old_snapshot:
+                all_data[name] = old_snapshot[name]
+                add_stat("modules_skipped")
+            else:
+                all_data[name] = extract_items(module, COMPILED_RULES.get(name))
+                fresh.add(name)
+            if module_hash:
+                module_hashes[name] = module_hash
+    if not modified:
+        return None
+
+    # 有变化或尚未建立列表页已知集合的模块补抓列表页
+    old_known = old_meta.get("list_known", {})
+    to_crawl = [
+        name for name in MODULE_LIST_URLS
+        if name in all_data and (name in fresh or name not in old_known)
+    ]
+    list_known, list_added = crawl_list_pages(to_crawl, old_snapshot, all_data)
+    list_known = {**old_known, **list_known}
+    old_watermarks = old_meta.get("watermarks", {})
+    watermarks = {}
+    for name in MODULE_IDS:
+        watermark = old_watermarks.get(name, 0)
+        # 沿用上次结果的模块条目已计入旧水位线，不必再读（分段快照中也就不必解码）
+        if name in fresh or name not in old_watermarks:
+            watermark = high_watermark(all_data.get(name, []), watermark)
+        watermark = high_watermark(list_added.get(name, []), watermark)
+        watermark = max([watermark] + list_known.get(name, []))
+        # 没有文章 id 的模块也记下 0，下次不必为求水位线再读它的条目
+        if watermark or name in all_data:
+            watermarks[name] = watermark
+    all_data[META_KEY] = {
+        "page_hashes": page_hashes,
+        "module_hashes": module_hashes,
+        "list_known": list_known,
+        "list_added": list_added,
+        "watermarks": watermarks,
+    }
     return all_data
 
-def load_snapshot(path):
+def print_run_stats():
+    requests_sent = RUN_STATS["requests"]
+    hit_rate = RUN_STATS["not_modified"] / requests_sent if requests_sent else 0
+    print(f"请求数：{requests_sent}，节省请求：{RUN_STATS['saved_requests']}，"
+          f"304 命中率：{hit_rate:.0%}")
+    print(f"整页未变化：{RUN_STATS['pages_unchanged']}，跳过模块：{RUN_STATS['modules_skipped']}，"
+          f"列表页：{RUN_STATS['list_pages']}")
+    print(f"读取字节：{RUN_STATS['bytes_read']}，提前结束的页面：{RUN_STATS['streams_stopped']}")
+    if any(RUN_STATS[k] for k in ("retries", "pages_failed", "breaker_rejected", "deadline_cut")):
+        print(f"重试：{RUN_STATS['retries']} 次（耗时 {RUN_STATS['retry_time']:.1f} s），"
+              f"失败页面：{RUN_STATS['pages_failed']}，熔断跳过：{RUN_STATS['breaker_rejected']}，"
+              f"超时中止：{RUN_STATS['deadline_cut']}")
+    connections = RUN_STATS["connections"]
+    if connections:
+        avg_connect = RUN_STATS["connect_time"] / connections
+        saved = RUN_STATS["reused_connections"] * avg_connect
+        print(f"新建连接：{connections}（平均 {avg_connect * 1000:.0f} ms），"
+              f"复用连接：{RUN_STATS['reused_connections']}，节省握手约 {saved * 1000:.0f} ms")
+    for kind, label in (("tls_full", "完整握手"), ("tls_resumed", "会话复用握手")):
+        if RUN_STATS[kind]:
+            avg = RUN_STATS[kind + "_time"] / RUN_STATS[kind]
+            print(f"{label}：{RUN_STATS[kind]} 次，平均 {avg * 1000:.1f} ms")
+
+# --------------------------
+# 快照存储
+# --------------------------
+
+def snapshot_backend(path):
+    """按扩展名选择快照存储方式"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".db", ".sqlite", ".sqlite3"):
+        return "sqlite"
+    if ext == ".bin":
+        return "segments"
+    return "log" if ext == ".jsonl" else "json"
+
+def snapshot_files(path):
+    """快照占用的全部文件（含发信前暂存的新快照），用于提交"""
+    if snapshot_backend(path) == "log":
+        files = [path, path + ".prev", checkpoint_path(path), checkpoint_path(path) + ".prev"]
+    else:
+        files = [path, path + ".prev"]
+    return files + [staged_snapshot_path(path)]
+
+class HistoryStore:
+    """SQLite 快照与历史库
+
+    - items：每个模块见过的所有条目，以 (模块, 身份键) 为主键，按文章 id 与地址建索引；
+      present 标记当前是否在首页上，first_seen / last_seen 为首次出现与最后一次在首页上的时间
+      （仍在首页上的条目 last_seen 为空，这样每次运行只需写入有变化的行）
+    - events：每次保存时产生的增删改事件，即完整的历史记录
+    - meta：快照元信息（页面指纹、列表页已知条目、水位线等），每个键一行
+    - modules：当前快照中的模块（包括暂时没有条目的模块）
+
+    load() 返回按需查询的快照；比对时新条目写入临时表，与当前状态按主键连接查询出增删改。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS items (
+        module TEXT NOT NULL,
+        key TEXT NOT NULL,
+        article_id INTEGER,
+        url TEXT NOT NULL,
+        title TEXT NOT NULL,
+        rank INTEGER NOT NULL DEFAULT 0,
+        data TEXT NOT NULL,
+        present INTEGER NOT NULL DEFAULT 1,
+        first_seen TEXT NOT NULL,
+        last_seen TEXT,
+        PRIMARY KEY (module, key)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS items_present ON items (module, present, rank);
+    CREATE INDEX IF NOT EXISTS items_article ON items (article_id);
+    CREATE INDEX IF NOT EXISTS items_url ON items (url);
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts TEXT NOT NULL,
+        module TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        key TEXT NOT NULL,
+        url TEXT NOT NULL,
+        title TEXT,
+        old_title TEXT
+    );
+    CREATE INDEX IF NOT EXISTS events_module ON events (module, ts);
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS modules (
+        module TEXT PRIMARY KEY
+    );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = self._open(path)
+
+    @classmethod
+    def _connect(cls, path):
+        """打开库并做快速完整性检查，损坏时抛出 sqlite3.DatabaseError"""
+        db = sqlite3.connect(path)
+        try:
+            result = db.execute("PRAGMA quick_check").fetchone()[0]
+            if result != "ok":
+                raise sqlite3.DatabaseError(result)
+            db.executescript(cls.SCHEMA)
+        except sqlite3.DatabaseError:
+            db.close()
+            raise
+        return db
+
+    @classmethod
+    def _open(cls, path):
+        """打开库，损坏时用上一代（保存前的备份）替换；都不可用时改用空库，重新建立基线"""
+        try:
+            return cls._connect(path)
+        except sqlite3.DatabaseError as e:
+            print(f"{path} 无法读取（{e}），尝试上一代。")
+        try:
+            if not os.path.exists(path + ".prev"):
+                raise sqlite3.DatabaseError("文件不存在")
+            cls._connect(path + ".prev").close()
+        except sqlite3.DatabaseError as e:
+            print(f"{path}.prev 无法读取（{e}）。")
+            print(f"警告：快照 {path} 及上一代均已损坏，将重新建立基线。")
+            os.remove(path)
+            return cls._connect(path)
+        with open(path + ".prev", "rb") as f:
+            write_atomic(path, f.read())
+        print(f"已回退到上一代文件 {path}.prev。")
+        return cls._connect(path)
+
+    def close(self):
+        self.db.close()
+
+    def load(self):
+        """读取当前状态，格式与 JSON 快照相同，各模块的条目第一次访问时才查询；空库返回 {}"""
+        # 当前没有条目的模块也属于快照（抓取时据此判断能否发条件请求）
+        modules = [module for (module,) in self.db.execute(
+            "SELECT module FROM modules UNION SELECT DISTINCT module FROM items WHERE present = 1")]
+        meta = {key: json.loads(value) for key, value in self.db.execute("SELECT key, value FROM meta")}
+        loaders = {module: functools.partial(self.module_items, module) for module in modules}
+        if meta:
+            loaders[META_KEY] = lambda: {key: meta_from_json(key, value) for key, value in meta.items()}
+        return LazySegments(loaders, store=self) if loaders else {}
+
+    def module_items(self, module):
+        rows = self.db.execute("SELECT data FROM items WHERE module = ? AND present = 1 ORDER BY rank", (module,))
+        return [Item.from_dict(json.loads(data)) for (data,) in rows]
+
+    def _stage(self, items):
+        """把新条目写入临时表 incoming，供与当前状态按主键连接查询"""
+        with self.db:
+            self.db.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS incoming "
+                "(key TEXT PRIMARY KEY, title TEXT NOT NULL, pos INTEGER NOT NULL) WITHOUT ROWID")
+            self.db.execute("DELETE FROM incoming")
+            self.db.executemany(
+                "INSERT OR IGNORE INTO incoming (key, title, pos) VALUES (?, ?, ?)",
+                [(str(item.key), item.title, pos) for pos, item in enumerate(items)])
+
+    def absent(self, module, items):
+        """items 中当前不在该模块首页上的条目，按原顺序"""
+        self._stage(items)
+        rows = self.db.execute(
+            "SELECT pos FROM incoming i WHERE NOT EXISTS "
+            "(SELECT 1 FROM items s WHERE s.module = ? AND s.key = i.key AND s.present = 1) ORDER BY pos", (module,))
+        return [items[pos] for (pos,) in rows]
+
+    def diff_module(self, module, items):
+        """用索引查询比对模块的新条目与库中的当前状态，返回 (新出现的条目, 消失的条目, 标题变化的条目)"""
+        appeared = self.absent(module, items)
+        removed = [Item.from_dict(json.loads(data)) for (data,) in self.db.execute(
+            "SELECT data FROM items s WHERE module = ? AND present = 1 "
+            "AND NOT EXISTS (SELECT 1 FROM incoming i WHERE i.key = s.key) ORDER BY rank", (module,))]
+        changed = [{"old": Item.from_dict(json.loads(data)), "new": items[pos]} for data, pos in self.db.execute(
+            "SELECT s.data, i.pos FROM incoming i JOIN items s ON s.module = ? AND s.key = i.key "
+            "WHERE s.present = 1 AND s.title != i.title ORDER BY i.pos", (module,))]
+        return appeared, removed, changed
+
+    def oldest_date(self, module):
+        """模块当前条目中最早的发布日期，没有日期时返回空串"""
+        row = self.db.execute(
+            "SELECT MIN(json_extract(data, '$.date')) FROM items WHERE module = ? AND present = 1 "
+            "AND json_extract(data, '$.date') GLOB '[0-9][0-9][0-9][0-9]-[0-9]*-[0-9]*'", (module,)).fetchone()
+        return row[0] or ""
+
+    def seen(self, module, key):
+        """条目是否曾在该模块出现过（走主键索引）"""
+        row = self.db.execute("SELECT 1 FROM items WHERE module = ? AND key = ?", (module, str(key))).fetchone()
+        return row is not None
+
+    def save(self, snapshot, events=True):
+        """在一个事务中写入新快照：与库中当前状态比对，只插入/更新有变化的行，并记录变化事件"""
+        ts = time.strftime("%Y-%m-%d %H:%M:%S")
+        snapshot = snapshot_to_json(snapshot)
+        log = []
+        self.backup()
+        with self.db:
+            for module, items in snapshot.items():
+                if module != META_KEY:
+                    self._save_module(module, items, ts, log)
+            # 快照中已没有的模块（如从 MODULE_RULES 中删去）：其条目全部标记为不在首页上
+            for (module,) in self.db.execute("SELECT DISTINCT module FROM items WHERE present = 1").fetchall():
+                if module not in snapshot:
+                    self._save_module(module, [], ts, log)
+            self.db.execute("DELETE FROM modules")
+            self.db.executemany(
+                "INSERT INTO modules (module) VALUES (?)", [(module,) for module in snapshot if module != META_KEY])
+            meta = snapshot.get(META_KEY, {})
+            for module, items in meta.get("list_added", {}).items():
+                for item in items:
+                    # 从首页滚出、只在列表页见到的条目只记入历史，不算在首页上
+                    inserted = self.db.execute(
+                        "INSERT OR IGNORE INTO items (module, key, article_id, url, title, data, present, "
+                        "first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)",
+                        (module, json_item_key(item), item.get("id"), item["url"], item["title"],
+                         json.dumps(item, ensure_ascii=False), ts, ts),
+                    ).rowcount
+                    if inserted:
+                        log.append((ts, module, "added", json_item_key(item), item["url"], item["title"], None))
+            old_meta = dict(self.db.execute("SELECT key, value FROM meta"))
+            for key, value in meta.items():
+                value = json.dumps(value, ensure_ascii=False, sort_keys=True)
+                if old_meta.get(key) != value:
+                    self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+            self.db.executemany("DELETE FROM meta WHERE key = ?", [(key,) for key in old_meta.keys() - meta.keys()])
+            if events:
+                self.db.executemany(
+                    "INSERT INTO events (ts, module, kind, key, url, title, old_title) VALUES (?, ?, ?, ?, ?, ?, ?)", log)
+        return len(log)
+
+    def backup(self):
+        """把当前库完整复制为上一代 <path>.prev，库损坏时据此恢复"""
+        tmp = f"{self.path}.prev.tmp"
+        target = sqlite3.connect(tmp)
+        try:
+            self.db.backup(target)
+        finally:
+            target.close()
+        os.replace(tmp, self.path + ".prev")
+
+    def _save_module(self, module, items, ts, log):
+        current = {
+            key: (rank, data)
+            for key, rank, data in self.db.execute(
+                "SELECT key, rank, data FROM items WHERE module = ? AND present = 1", (module,))
+        }
+        keys = set()
+        for rank, item in enumerate(items):
+            key = json_item_key(item)
+            keys.add(key)
+            data = json.dumps(item, ensure_ascii=False)
+            if key in current:
+                if current[key] != (rank, data):
+                    old_title = json.loads(current[key][1])["title"]
+                    self.db.execute(
+                        "UPDATE items SET url = ?, title = ?, rank = ?, data = ? WHERE module = ? AND key = ?",
+                        (item["url"], item["title"], rank, data, module, key))
+                    if old_title != item["title"]:
+                        log.append((ts, module, "changed", key, item["url"], item["title"], old_title))
+                continue
+            # 新条目，或曾经出现过、从首页消失后又回来的条目
+            returning = self.seen(module, key)
+            self.db.execute(
+                "INSERT INTO items (module, key, article_id, url, title, rank, data, present, first_seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT (module, key) DO UPDATE SET url = excluded.url, title = excluded.title, "
+                "rank = excluded.rank, data = excluded.data, present = 1, last_seen = NULL",
+                (module, key, item.get("id"), item["url"], item["title"], rank, data, ts))
+            log.append((ts, module, "resurfaced" if returning else "added", key, item["url"], item["title"], None))
+        for key in current.keys() - keys:
+            self.db.execute(
+                "UPDATE items SET present = 0, last_seen = ? WHERE module = ? AND key = ?", (ts, module, key))
+            item = json.loads(current[key][1])
+            log.append((ts, module, "removed", key, item["url"], item["title"], None))
+
+# 快照与检查点中存放校验和的键
+CHECKSUM_KEY = "_checksum"
+
+def snapshot_checksum(data):
+    """对内容的规范化序列化计算校验和，与写入时的缩进、键顺序无关"""
+    body = {k: v for k, v in data.items() if k != CHECKSUM_KEY}
+    return fingerprint(json.dumps(body, ensure_ascii=False, sort_keys=True, separators=(",", ":")))
+
+# 本次运行中读取时发现已损坏的文件，覆盖时不应把它轮换成上一代
+_CORRUPT_FILES = set()
+
+def write_checked_json(path, data, keep_previous=True, **kwargs):
+    """带校验和原子写入，并保留上一代文件（当前文件已损坏时保留原有的上一代）"""
+    keep_previous = keep_previous and path not in _CORRUPT_FILES
+    write_json(path, {**data, CHECKSUM_KEY: snapshot_checksum(data)}, keep_previous=keep_previous, **kwargs)
+    _CORRUPT_FILES.discard(path)
+
+def read_checked_json(path):
+    """读取并校验文件，损坏（截断、校验和不符）时依次回退到上一代；都不可用时返回 None
+
+    没有校验和的旧格式文件只要能解析即视为有效。
+    """
+    for candidate in (path, path + ".prev"):
+        try:
+            with open(candidate, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError) as e:
+            print(f"{candidate} 无法读取（{e}），尝试上一代。")
+            _CORRUPT_FILES.add(candidate)
+            continue
+        if not isinstance(data, dict):
+            print(f"{candidate} 格式不正确，尝试上一代。")
+            _CORRUPT_FILES.add(candidate)
+            continue
+        checksum = data.pop(CHECKSUM_KEY, None)
+        if checksum is not None and checksum != snapshot_checksum(data):
+            print(f"{candidate} 校验和不符，尝试上一代。")
+            _CORRUPT_FILES.add(candidate)
+            continue
+        if candidate != path:
+            print(f"已回退到上一代文件 {candidate}。")
+        return data
+    return None
+
+# --------------------------
+# 事件日志
+# 每行一条事件：add / change（带条目内容）、order（模块条目的新顺序，多为在前面加上新条目并截去末尾，
+# 只记新加的键与保留的条数）、module（模块加入/移出快照）、meta（元信息按模块/页面逐项记录，
+# 列表只记新加在前面的部分），只追加不改写，每次写入量与变化量成正比。每次保存的事件以一行 commit 结尾，
+# 读取时只重放到最后一个 commit，保存到一半中断或中间某行损坏都不会留下只应用了一部分的状态。
+# 日志首行记录代号；压缩时写检查点并换用新一代日志，上一代日志保留为 .prev，
+# 检查点损坏回退到上一代时仍能从上一代日志补齐，日志文件的大小因此有上限
+# --------------------------
+
+# {日志路径: {"state": 当前状态（JSON 形式）, "gen": 当前日志的代号, "end": 最后一条完整事件之后的位置,
+#            "events": 检查点之后的事件数}}
+_EVENT_LOGS = {}
+
+def checkpoint_path(path):
+    return os.path.splitext(path)[0] + ".checkpoint.json"
+
+def _list_delta(before, after):
+    """after 为 before 的前 keep 项前面加上若干新项时，返回 (新项, keep)，否则返回 None"""
+    for n in range(len(after) + 1):
+        keep = len(after) - n
+        if keep <= len(before) and after[n:] == before[:keep]:
+            return after[:n], keep
+    return None
+
+def _relative_item(item, rank):
+    """事件中的条目：pos 与所在位置一致时省略，条目整体前移后移不算内容变化；没有 pos 时记为 0"""
+    item = dict(item)
+    pos = item.pop("pos", 0)
+    if pos != rank + 1:
+        item["pos"] = pos
+    return item
+
+def _absolute_item(item, rank):
+    item = dict(item)
+    pos = item.pop("pos", rank + 1)
+    if pos:
+        item["pos"] = pos
+    return item
+
+def snapshot_events(old, new):
+    """比对两个快照的完整状态，返回把 old 变成 new 的事件列表"""
+    events = []
+    for module in [m for m in new if m != META_KEY] + [m for m in old if m != META_KEY and m not in new]:
+        old_keys = [json_item_key(item) for item in old.get(module, [])]
+        old_items = {key: _relative_item(item, rank) for rank, (key, item) in enumerate(zip(old_keys, old.get(module, [])))}
+        new_keys = []
+        for rank, item in enumerate(new.get(module, [])):
+            key = json_item_key(item)
+            new_keys.append(key)
+            item = _relative_item(item, rank)
+            if old_items.get(key) != item:
+                op = "change" if key in old_items else "add"
+                events.append({"op": op, "module": module, "key": key, "item": item})
+        if module in new and new_keys != old_keys:
+            event = {"op": "order", "module": module}
+            delta = _list_delta(old_keys, new_keys)
+            if delta:
+                event["prepend"], event["keep"] = delta
+            else:
+                event["keys"] = new_keys
+            events.append(event)
+        if (module in new) != (module in old):
+            # 模块本身加入或移出快照（没有条目的模块也要记下，否则重建后缺少该模块）
+            events.append({"op": "module", "module": module, "present": module in new})
+    old_meta, new_meta = old.get(META_KEY, {}), new.get(META_KEY, {})
+    for key in new_meta.keys() | old_meta.keys():
+        old_value, new_value = old_meta.get(key), new_meta.get(key)
+        if old_value == new_value:
+            continue
+        if not (isinstance(old_value, dict) and isinstance(new_value, dict)):
+            events.append({"op": "meta", "key": key, "value": new_value})
+            continue
+        for field in new_value.keys() | old_value.keys():
+            before, after = old_value.get(field), new_value.get(field)
+            if before == after:
+                continue
+            event = {"op": "meta", "key": key, "field": field, "value": after}
+            delta = _list_delta(before, after) if isinstance(before, list) and isinstance(after, list) else None
+            if delta:
+                del event["value"]
+                event["prepend"], event["keep"] = delta
+            events.append(event)
+    return events
+
+def apply_events(state, events):
+    """把事件依次应用到状态上（原地修改），用于由检查点重建当前状态"""
+    # {模块: ({键: 条目}, [键])}：条目内容与顺序分开记，最后按顺序还原
+    modules = {}
+    for event in events:
+        if event["op"] == "meta":
+            meta = state.setdefault(META_KEY, {})
+            if "field" in event:
+                meta, key = meta.setdefault(event["key"], {}), event["field"]
+            else:
+                key = event["key"]
+            if "prepend" in event:
+                meta[key] = event["prepend"] + meta.get(key, [])[:event["keep"]]
+            elif event["value"] is None:
+                meta.pop(key, None)
+            else:
+                meta[key] = event["value"]
+            continue
+        module = event["module"]
+        if event["op"] == "module":
+            if event["present"]:
+                state.setdefault(module, [])
+            else:
+                modules.pop(module, None)
+                state.pop(module, None)
+            continue
+        if module not in modules:
+            items = state.get(module, [])
+            keys = [json_item_key(item) for item in items]
+            modules[module] = ({key: _relative_item(item, rank) for rank, (key, item) in enumerate(zip(keys, items))}, keys)
+        entries, order = modules[module]
+        if event["op"] == "order":
+            order[:] = event["keys"] if "keys" in event else event["prepend"] + order[:event["keep"]]
+        else:
+            entries[event["key"]] = event["item"]
+    for module, (entries, order) in modules.items():
+        state[module] = [_absolute_item(entries[key], rank) for rank, key in enumerate(order)]
+    return state
+
+LOG_COMMIT = json.dumps({"op": "commit"}).encode("utf-8") + b"\n"
+
+def log_header(gen):
+    return json.dumps({"op": "log", "gen": gen}).encode("utf-8") + b"\n"
+
+def read_log(path):
+    """读取一代日志，返回 (代号, [(事件结束位置, 事件)], 最后一条完整事件之后的位置)；文件不存在时返回 None
+
+    没有首行代号的日志（旧版本写入）视为第 0 代；只取到最后一个 commit 为止的事件（没有 commit 的旧日志取全部），
+    末尾写了一半的保存（写入时中断）忽略；无法解析的行（文件损坏）视为有效日志的结尾，
+    其后的事件一并丢弃。返回的结束位置即有效部分的结尾，下次写入时从该处覆盖。
+    """
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    gen, events, end, start = 0, [], 0, 0
+    committed, damaged = None, False
+    for line in data.splitlines(keepends=True):
+        if not line.endswith(b"\n"):
+            break
+        try:
+            event = json.loads(line)
+            op = event["op"]
+        except (ValueError, TypeError, KeyError) as e:
+            print(f"{path} 在第 {end} 字节处损坏（{e!r}），只读取此前的事件。")
+            damaged = True
+            break
+        end += len(line)
+        if op == "log":
+            gen, start = event["gen"], end
+        elif op == "commit":
+            committed = (len(events), end)
+        else:
+            events.append((end, event))
+    if committed is None and damaged:
+        # 损坏处之前没有完整的保存，无法判断哪些事件可用
+        committed = (0, start)
+    if committed is not None:
+        events, end = events[:committed[0]], committed[1]
+    return gen, events, end
+
+def load_event_log(path):
+    """读取检查点，重放其后的日志（上一代日志中检查点之后的部分与当前日志）"""
+    # 检查点损坏时回退到上一代检查点，其后的事件仍在上一代与当前日志中，重放得更多而已
+    checkpoint = read_checked_json(checkpoint_path(path)) or {}
+    gen, offset = checkpoint.get("gen", 0), checkpoint.get("offset", 0)
+    state, events = checkpoint.get("state", {}), []
+    current = read_log(path)
+    previous = read_log(path + ".prev")
+    for log in (previous, current):
+        if log is not None and log[0] >= gen:
+            events += [event for end, event in log[1] if log[0] > gen or end > offset]
+    replayed = len(events)
+    try:
+        snapshot = snapshot_from_json(apply_events(state, events))
+    except (KeyError, TypeError, ValueError, IndexError, AttributeError) as e:
+        # 检查点与日志都读得出来却无法重放：当作没有快照，下次保存时立即压缩出新的检查点，不再重放这些事件
+        print(f"警告：事件日志 {path} 无法重放（{e!r}），将重新建立基线。")
+        state, snapshot, replayed = {}, {}, LOG_COMPACT_EVERY
+    if current is None:
+        # 压缩途中中断、新一代日志尚未建立：下次写入时新建，代号高于已有的各代
+        log_gen, end = max(gen, previous[0] if previous else 0) + 1, 0
+    else:
+        log_gen, end = current[0], current[2]
+    _EVENT_LOGS[path] = {"state": state, "gen": log_gen, "events": replayed, "end": end}
+    return snapshot
+
+def save_event_log(path, data):
+    """追加相对上次状态的事件；累计事件数达到 LOG_COMPACT_EVERY 时写检查点并换用新一代日志"""
+    log = _EVENT_LOGS.get(path)
+    if log is None:
+        load_event_log(path)
+        log = _EVENT_LOGS[path]
+    data = snapshot_to_json(data)
+    events = snapshot_events(log["state"], data)
+    if events:
+        with open(path, "ab") as f:
+            # 丢弃上次中断时残留的半行，保证日志每行都是完整事件
+            f.truncate(log["end"])
+            if not log["end"]:
+                f.write(log_header(log["gen"]))
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n")
+            f.write(LOG_COMMIT)
+            f.flush()
+            os.fsync(f.fileno())
+            log["end"] = f.tell()
+    log["state"] = data
+    log["events"] += len(events)
+    if log["events"] >= LOG_COMPACT_EVERY:
+        # 依次：当前日志转为上一代 → 建立只有代号的新日志 → 写指向新日志开头的检查点；
+        # 任何一步中断，检查点与两代日志仍能重建出同样的状态
+        gen = log["gen"] + 1
+        if os.path.exists(path):
+            os.replace(path, path + ".prev")
+        write_atomic(path, log_header(gen))
+        write_checked_json(checkpoint_path(path), {"gen": gen, "offset": len(log_header(gen)), "state": log["state"]})
+        log.update(gen=gen, end=len(log_header(gen)), events=0)
+    return len(events)
+
+# 当前打开的 SQLite 历史库（快照为 .db 时），比对时用于查询完整历史
+_HISTORY = None
+
+def open_history(path):
+    global _HISTORY
+    if _HISTORY is None or _HISTORY.path != path:
+        _HISTORY = HistoryStore(path)
+    return _HISTORY
+
+# --------------------------
+# 分段二进制快照
+# 文件：魔数 | 索引长度 (u32) | 索引 | 索引 CRC32 (u32) | 各段数据
+# 索引为 {段名: [偏移, 长度, CRC32]}，段名为模块名与 "_meta/<元信息键>"
+# 模块段为 zlib 压缩的 {"strings": 字符串表, "rows": 条目行}，行为 [文章 id, 地址前缀, 地址后缀, 标题, 其他字段]，
+# 与 Item 一一对应：地址的前后两部分放进本段的字符串表，只存序号；pos 与条目顺序一致时省略。
+# 每段自成一体，未变化的模块保存时原样写回，不解码也不重新编码。
+# 元信息段为 zlib 压缩的 JSON。
+# --------------------------
+
+SEGMENT_MAGIC = b"NUBSSEG2"
+
+def encode_items(items):
+    """把模块条目编码为字符串表与行"""
+    strings, rows = {}, []
+    for rank, item in enumerate(items):
+        extra = {k: v for k, v in zip(("date", "full_title", "pinned"), (item.date, item.full_title, item.pinned)) if v}
+        if item.pos != rank + 1:
+            extra["pos"] = item.pos
+        row = [item.id, strings.setdefault(item.head, len(strings)), strings.setdefault(item.tail, len(strings)), item.title]
+        if extra:
+            row.append(extra)
+        rows.append(row)
+    return {"strings": list(strings), "rows": rows}
+
+def decode_items(data):
+    """由行还原条目，地址片段引用驻留后的字符串"""
+    strings = [sys.intern(text) for text in data["strings"]]
+    items = []
+    for rank, row in enumerate(data["rows"]):
+        extra = row[4] if len(row) > 4 else {}
+        pos = extra.pop("pos", rank + 1) or 0
+        if "date" in extra:
+            extra["date"] = sys.intern(extra["date"])
+        items.append(Item(row[3], strings[row[1]], row[0], strings[row[2]], pos, **extra))
+    return items
+
+def _pack(value):
+    return zlib.compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 9)
+
+class LazyModule(Sequence):
+    """分段快照中一个模块的条目：第一次读取时才解码；保存快照时直接写回原来的压缩段"""
+
+    def __init__(self, blob):
+        self.blob = blob
+        self._items = None
+
+    def _decoded(self):
+        if self._items is None:
+            self._items = decode_items(json.loads(zlib.decompress(self.blob)))
+        return self._items
+
+    def __getitem__(self, index):
+        return self._decoded()[index]
+
+    def __len__(self):
+        return len(self._decoded())
+
+def save_segments(path, data, keep_previous=True):
+    """写入分段快照（原子写入，默认保留上一代）"""
+    segments = {}
+    for key, value in data.items():
+        if key == META_KEY:
+            for meta_key, meta_value in value.items():
+                segments[f"{META_KEY}/{meta_key}"] = _pack(meta_to_json(meta_key, meta_value))
+        elif isinstance(value, LazyModule):
+            segments[key] = value.blob
+        else:
+            segments[key] = _pack(encode_items(value))
+    index, offset = {}, 0
+    for name, blob in segments.items():
+        index[name] = [offset, len(blob), zlib.crc32(blob)]
+        offset += len(blob)
+    index_blob = json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    header = SEGMENT_MAGIC + struct.pack(">I", len(index_blob)) + index_blob + struct.pack(">I", zlib.crc32(index_blob))
+    write_atomic(path, header + b"".join(segments.values()), keep_previous=keep_previous and path not in _CORRUPT_FILES)
+    _CORRUPT_FILES.discard(path)
+
+class LazySegments(Mapping):
+    """按需加载的只读映射：{键: 无参加载函数}，每个键第一次访问时才加载并缓存
+
+    store：快照读自 SQLite 历史库时为该库，比对时直接在库中查询。
+    """
+
+    def __init__(self, loaders, store=None):
+        self._loaders = loaders
+        self._values = {}
+        self.store = store
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            self._values[key] = self._loaders[key]()
+        return self._values[key]
+
+    def __contains__(self, key):
+        return key in self._loaders
+
+    def __iter__(self):
+        return iter(self._loaders)
+
+    def __len__(self):
+        return len(self._loaders)
+
+def open_segments(path):
+    """读取分段快照的索引，返回按需加载的快照（模块为 LazyModule）；文件或索引损坏时抛出 ValueError"""
+    with open(path, "rb") as f:
+        blob = f.read()
+    if not blob.startswith(SEGMENT_MAGIC):
+        raise ValueError("不是分段快照")
+    start = len(SEGMENT_MAGIC)
+    (size,) = struct.unpack(">I", blob[start:start + 4])
+    index_blob = blob[start + 4:start + 4 + size]
+    (checksum,) = struct.unpack(">I", blob[start + 4 + size:start + 8 + size])
+    if zlib.crc32(index_blob) != checksum:
+        raise ValueError("索引校验和不符")
+    index = json.loads(index_blob)
+    base = start + 8 + size
+    if any(base + offset + length > len(blob) for offset, length, _ in index.values()):
+        raise ValueError("文件被截断")
+
+    def segment(name):
+        offset, length, crc = index[name]
+        data = blob[base + offset:base + offset + length]
+        if zlib.crc32(data) != crc:
+            raise ValueError(f"快照段 {name} 校验和不符")
+        return data
+
+    loaders = {
+        name: functools.partial(lambda name: LazyModule(segment(name)), name)
+        for name in index if not name.startswith(META_KEY + "/")
+    }
+    meta = {
+        name.split("/", 1)[1]: functools.partial(
+            lambda name: meta_from_json(name.split("/", 1)[1], json.loads(zlib.decompress(segment(name)))), name)
+        for name in index if name.startswith(META_KEY + "/")
+    }
+    if meta:
+        loaders[META_KEY] = lambda: LazySegments(meta)
+    return LazySegments(loaders)
+
+def load_segments(path):
+    """读取分段快照，损坏时回退到上一代；都不可用时返回 None"""
+    for candidate in (path, path + ".prev"):
+        try:
+            snapshot = open_segments(candidate)
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError, struct.error) as e:
+            print(f"{candidate} 无法读取（{e}），尝试上一代。")
+            _CORRUPT_FILES.add(candidate)
+            continue
+        if candidate != path:
+            print(f"已回退到上一代文件 {candidate}。")
+        return snapshot
+    return None
+
+def materialize(snapshot):
+    """把按需解码的快照完全展开为普通 dict"""
+    return {
+        key: dict(value) if key == META_KEY else list(value)
+        for key, value in snapshot.items()
+    }
+
+def load_snapshot(path):
+    backend = snapshot_backend(path)
+    if backend != "json":
+        # 首次改用其他存储方式时自动导入同名的 JSON 快照
+        legacy = os.path.splitext(path)[0] + ".json"
+        if not any(os.path.exists(p) for p in snapshot_files(path)) and os.path.exists(legacy):
+            convert_snapshot(legacy, path)
+    if backend == "sqlite":
+        return open_history(path).load()
+    if backend == "log":
+        return load_event_log(path)
+    snapshot = load_segments(path) if backend == "segments" else read_checked_json(path)
+    if snapshot is None:
+        if os.path.exists(path):
+            # 所有代都损坏时只能重新建立基线，明确提示，而不是悄悄当作首次运行
+            print(f"警告：快照 {path} 及上一代均已损坏，将重新建立基线。")
         return {}
+    return snapshot if backend == "segments" else snapshot_from_json(snapshot)
 
 def save_snapshot(path, data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    if snapshot_backend(path) == "sqlite":
+        open_history(path).save(data)
+        return
+    if snapshot_backend(path) == "log":
+        save_event_log(path, data)
+        return
+    if snapshot_backend(path) == "segments":
+        save_segments(path, data)
+        return
+    write_checked_json(path, snapshot_to_json(data), indent=2)
+
+def staged_snapshot_path(path):
+    return path + ".next"
+
+def stage_snapshot(path, data):
+    """发信前把新快照写入暂存文件，返回其路径；邮件发出后再由 promote_snapshot 替换正式快照
+
+    JSON 快照暂存为 JSON；其他存储方式一律暂存为分段快照，未变化的模块原样写回，不解码。
+    """
+    staged = staged_snapshot_path(path)
+    if snapshot_backend(path) == "json":
+        write_checked_json(staged, snapshot_to_json(data), keep_previous=False, indent=2)
+    else:
+        save_segments(staged, data, keep_previous=False)
+    return staged
+
+def promote_snapshot(path, staged):
+    """用暂存的新快照替换正式快照：JSON 与分段快照直接改名（旧文件保留为上一代），
+    SQLite 与事件日志按暂存内容写入"""
+    if snapshot_backend(path) in ("json", "segments"):
+        if os.path.exists(path) and path not in _CORRUPT_FILES:
+            os.replace(path, path + ".prev")
+        os.replace(staged, path)
+        _CORRUPT_FILES.discard(path)
+    else:
+        save_snapshot(path, open_segments(staged))
+        os.remove(staged)
+
+def convert_snapshot(src, dst):
+    """在不同存储方式之间转换快照，如 JSON 导入 SQLite 或事件日志、导出为 JSON（只转换当前状态）"""
+    data = materialize(load_snapshot(src))
+    if snapshot_backend(dst) == "sqlite":
+        open_history(dst).save(data, events=False)
+    else:
+        save_snapshot(dst, data)
+    print(f"已将 {src} 转换为 {dst}：{sum(len(v) for k, v in data.items() if k != META_KEY)} 条。")
 
 def diff_snapshots(old, new):
     diffs = {}
+    store = getattr(old, "store", None)
+    old_hashes = old.get(META_KEY, {}).get("module_hashes", {})
+    new_hashes = new.get(META_KEY, {}).get("module_hashes", {})
+    # 列表页补抓到的、已从首页滚出的新条目
+    list_added = new.get(META_KEY, {}).get("list_added", {})
     for module in MODULE_IDS:
-        old_items = {item["url"]: item for item in old.get(module, [])}
-        new_items = {item["url"]: item for item in new.get(module, [])}
-        added = [v for k, v in new_items.items() if k not in old_items]
-        removed = [v for k, v in old_items.items() if k not in new_items]
-        changed = [
-            {"old": old_items[k], "new": new_items[k]}
-            for k in new_items
-            if k in old_items and old_items[k]["title"] != new_items[k]["title"]
-        ]
-        diffs[module] = {"added": added, "removed": removed, "changed": changed}
+        if (module in old_hashes and old_hashes[module] == new_hashes.get(module)
+                and not list_added.get(module)):
+            # 模块片段与上次完全相同，无需比对
+            diffs[module] = {"added": [], "added_old": [], "removed": [], "changed": []}
+            continue
+        # 以文章 id（非文章链接为规范化地址）为键，同一文章的不同写法不会被当成增删
+        new_items = list({item.key: item for item in new.get(module, [])}.values())
+        if store is not None:
+            # 旧快照即 SQLite 历史库中的当前状态：增删改直接用索引查询得出，不读出旧条目
+            appeared, removed, changed = store.diff_module(module, new_items)
+            oldest = store.oldest_date(module)
+            scrolled = store.absent(module, list_added.get(module, []))
+        else:
+            old_items = {item.key: item for item in old.get(module, [])}
+            new_keys = {item.key for item in new_items}
+            appeared = [v for v in new_items if v.key not in old_items]
+            removed = [v for k, v in old_items.items() if k not in new_keys]
+            changed = [
+                {"old": old_items[v.key], "new": v}
+                for v in new_items
+                if v.key in old_items and old_items[v.key].title != v.title
+            ]
+            oldest = min((v.date for v in old_items.values() if _DATE_RE.fullmatch(v.date)), default="")
+            scrolled = [v for v in list_added.get(module, []) if v.key not in old_items]
+        # 文章 id 高于上次水位线的必为新发布；其余新出现的条目再判断是否为旧文章
+        watermark = old.get(META_KEY, {}).get("watermarks", {}).get(module, 0)
+        known = None
+        added, added_old = [], []
+        for v in appeared:
+            if watermark and v.id > watermark:
+                added.append(v)
+                continue
+            # 首页上新出现、但已在列表页见过，或发布日期早于上次首页最旧条目的，
+            # 是旧文章重新浮上来（如调整排序、置顶），不算新发布
+            if known is None:
+                # 这些条目都不在旧首页上，只需查列表页已知条目
+                known = known_keys(old, module, homepage=False)
+            if ((watermark and v.key in known) or (_HISTORY is not None and _HISTORY.seen(module, v.key))
+                    or (_DATE_RE.fullmatch(v.date) and v.date < oldest)):
+                added_old.append(v)
+            else:
+                added.append(v)
+        added += scrolled
+        # 按发布日期从新到旧排列，无日期或日期不完整（如只有月日）的条目保持页面顺序排在后面
+        added.sort(key=lambda v: v.date if _DATE_RE.fullmatch(v.date) else "", reverse=True)
+        diffs[module] = {"added": added, "added_old": added_old, "removed": removed, "changed": changed}
     return diffs
 
 def summarize_diffs(diffs):
@@ -160,21 +2173,45 @@ def summarize_diffs(diffs):
             continue
         lines.append(f"\n### {module} ###")
         for item in added:
-            lines.append(f"+ {item['title']} {item['url']}")
+            date = f"[{item.date}] " if item.date else ""
+            lines.append(f"+ {date}{item.display_title} {item.url}")
+            detail = _ARTICLES.get(item.url)
+            if detail:
+                if detail["title"] and detail["title"] != item.title:
+                    lines.append(f"  标题：{detail['title']}")
+                if detail["date"]:
+                    lines.append(f"  发布：{detail['date']}")
+                if detail["preview"]:
+                    lines.append(f"  摘要：{detail['preview']}")
+        for item in info.get("added_old", []):
+            date = f"[{item.date}] " if item.date else ""
+            lines.append(f"↺ {date}{item.display_title} {item.url}（旧文章重新出现）")
         for item in removed:
-            lines.append(f"- {item['title']} {item['url']}")
+            lines.append(f"- {item.title} {item.url}")
         for item in changed:
-            lines.append(f"* {item['old']['title']} -> {item['new']['title']} {item['new']['url']}")
+            lines.append(f"* {item['old'].title} -> {item['new'].title} {item['new'].url}")
     return "\n".join(lines)
 
-def send_email_combined(subject: str, user_recipients: dict):
-    """按订阅合并，给每个收件人只发一封综合邮件"""
-    if not user_recipients:
-        return
-    try:
+def send_email_combined(subject: str, user_recipients: dict, on_sent=None, on_attempt=None):
+    """按订阅合并，给每个收件人只发一封综合邮件；返回因阶段超时或发送失败未发出的部分
 
-        for recipient, body_parts in user_recipients.items():
-            s = smtplib.SMTP_SSL(SMTP_HOST, 465, timeout=30)
+    连上 SMTP 服务器即调用 on_attempt(收件人)，每发出一封即调用 on_sent(收件人)，
+    供运行日志立即记录尝试次数与投递结果；因阶段超时未连接的收件人不算尝试。
+    """
+    unsent = {}
+    if not user_recipients:
+        return unsent
+    timed_out = 0
+    for recipient, body_parts in user_recipients.items():
+        left = time_left()
+        if left < 5:
+            unsent[recipient] = body_parts
+            timed_out += 1
+            continue
+        try:
+            s = smtplib.SMTP_SSL(SMTP_HOST, 465, timeout=min(SMTP_TIMEOUT, left))
+            if on_attempt:
+                on_attempt(recipient)
             s.login(SMTP_USER, SMTP_PASS)
             full_body = "\n\n".join(body_parts)
             msg = MIMEText(full_body, "plain", "utf-8")
@@ -182,66 +2219,295 @@ def send_email_combined(subject: str, user_recipients: dict):
             msg["To"] = recipient
             msg["Subject"] = Header(subject, "utf-8")
             s.sendmail(EMAIL_FROM, [recipient], msg.as_string())
-            print(f"邮件已发送 → {recipient}")
+        except Exception as e:
+            print(f"综合邮件发送失败 → {recipient}：", e)
+            unsent[recipient] = body_parts
+            continue
+        print(f"邮件已发送 → {recipient}")
+        if on_sent:
+            on_sent(recipient)
+        try:
             s.quit()
-            time.sleep(2)
+        except Exception:
+            pass
+        time.sleep(2)
+    if timed_out:
+        print(f"发信阶段超时，{timed_out} 封邮件顺延到下次运行。")
+    return unsent
 
-    except Exception as e:
-        print("综合邮件发送失败：", e)
+# --------------------------
+# 运行日志
+# 步骤：diffed（已比对，待发信）→ saved（已发信并保存快照，待提交）→ done
+# staged：发信前暂存的新快照文件，发信后替换正式快照（日志本身只记变化，不含快照）
+# updates：{更新 id: {"module": 模块, "time": 时间, "diff": 模块变化}}，发信时才生成正文
+# messages：{收件人键: {"updates": [更新 id], "status": "pending" | "sent", "attempts": 次数}}
+# --------------------------
+
+def recipient_key(recipient):
+    """日志中代表收件人的键：以 JOURNAL_SALT 为密钥的 HMAC，提交的日志里不出现邮箱地址"""
+    return hmac.new(JOURNAL_SALT.encode(), recipient.encode(), hashlib.sha256).hexdigest()[:16]
+
+def subscribed_recipients():
+    """{收件人键: 邮箱}；已退订的收件人无法从日志中还原"""
+    return {recipient_key(r): r for recipients in MODULE_SUBSCRIPTIONS.values() for r in recipients}
+
+def diff_to_json(info):
+    data = {kind: [item.to_dict() for item in info.get(kind, [])] for kind in ("added", "added_old", "removed")}
+    data["changed"] = [{side: c[side].to_dict() for side in ("old", "new")} for c in info["changed"]]
+    return data
+
+def diff_from_json(data):
+    info = {kind: [Item.from_dict(item) for item in data[kind]] for kind in ("added", "added_old", "removed")}
+    info["changed"] = [{side: Item.from_dict(c[side]) for side in ("old", "new")} for c in data["changed"]]
+    return info
+
+def render_update(update):
+    """一个模块一次更新的邮件文本"""
+    module = update["module"]
+    summary = summarize_diffs({module: diff_from_json(update["diff"])})
+    return f"### {module} 更新 ({update['time']}) ###\n{summary}"
+
+def load_journal(path):
+    return read_checked_json(path) or {"step": "done", "updates": {}, "messages": {}}
+
+def save_journal(path, journal):
+    write_checked_json(path, journal, keep_previous=False, indent=2)
+
+def new_journal(subject, updates, deliveries, staged, attempts=None):
+    """deliveries：{收件人键: [更新 id]}；staged：暂存的新快照文件（快照未变化时为 None）；
+    attempts：上次日志中各收件人已尝试的次数"""
+    attempts = attempts or {}
+    return {
+        "run": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "step": "diffed",
+        "subject": subject,
+        "staged": staged,
+        "updates": updates,
+        "messages": {
+            key: {"updates": ids, "status": "pending", "attempts": attempts.get(key, 0)}
+            for key, ids in deliveries.items()
+        },
+    }
+
+def undelivered(journal):
+    """日志中尚未投递的部分：({更新 id: 更新}, {收件人键: [更新 id]})"""
+    deliveries = {key: m["updates"] for key, m in journal["messages"].items() if m["status"] != "sent"}
+    ids = {uid for uids in deliveries.values() for uid in uids}
+    return {uid: u for uid, u in journal["updates"].items() if uid in ids}, deliveries
+
+def finish_run(journal):
+    """从运行日志记录的步骤继续：发信 → 推送投递结果 → 保存快照与状态文件 → 提交
+
+    每封邮件发出后立即写入本地日志；整批发完先单独推送日志，再用暂存的新快照替换正式快照。之后的提交即使失败，
+    从新检出的仓库开始的下次运行也知道哪些邮件已经发出。发出邮件到这次推送成功之间中断的，
+    只有在保留工作目录的运行环境中才不会重发。
+    未能投递的邮件留在日志里，由下次运行重试，超过 JOURNAL_MAX_ATTEMPTS 次后放弃。
+    """
+    addresses = subscribed_recipients()
+    if journal["step"] == "diffed":
+        begin_phase("email")
+        sent = []
+
+        def attempted(recipient):
+            journal["messages"][recipient_key(recipient)]["attempts"] += 1
+            save_journal(JOURNAL_FILE, journal)
 
+        def delivered(recipient):
+            journal["messages"][recipient_key(recipient)]["status"] = "sent"
+            save_journal(JOURNAL_FILE, journal)
+            sent.append(recipient)
 
-def git_commit_and_push(filepath):
+        pending = [
+            key for key, m in journal["messages"].items()
+            if m["status"] != "sent" and key in addresses
+        ]
+        emails = {
+            addresses[key]: [render_update(journal["updates"][uid]) for uid in journal["messages"][key]["updates"]]
+            for key in pending
+        }
+        send_email_combined(journal["subject"], emails, on_sent=delivered, on_attempt=attempted)
+        if sent and not git_commit_and_push(JOURNAL_FILE, phase="journal"):
+            print("投递结果未能推送，继续在本地保存快照。")
+        if journal.get("staged"):
+            # 替换后中断再继续时暂存文件已不存在，快照已是新的
+            if os.path.exists(journal["staged"]):
+                promote_snapshot(SNAPSHOT_FILE, journal["staged"])
+            save_validators(VALIDATORS_FILE)
+            save_breakers(BREAKER_FILE)
+            save_articles(ARTICLES_FILE)
+        journal["step"] = "saved"
+        save_journal(JOURNAL_FILE, journal)
+    messages = {}
+    for key, message in journal["messages"].items():
+        if message["status"] == "sent":
+            continue
+        if key not in addresses:
+            print(f"收件人 {key} 已退订，放弃其未投递的邮件。")
+            continue
+        if message["attempts"] >= JOURNAL_MAX_ATTEMPTS:
+            print(f"发往 {addresses[key]} 的邮件已尝试 {message['attempts']} 次，放弃。")
+            continue
+        messages[key] = message
+    updates, _ = undelivered({"updates": journal["updates"], "messages": messages})
+    journal = {"step": "done", "run": journal.get("run"), "updates": updates, "messages": messages}
+    save_journal(JOURNAL_FILE, journal)
+    files = [*snapshot_files(SNAPSHOT_FILE), VALIDATORS_FILE, BREAKER_FILE, ARTICLES_FILE, JOURNAL_FILE]
+    if not git_commit_and_push(*files):
+        print("提交失败：快照已在本地保存，运行日志已完成，下次运行一并提交。")
+
+
+def git_commit_and_push(*filepaths, phase="git"):
+    """提交并推送；phase 为占用的运行时间阶段，推送运行日志时用各自的小份额，不占用提交阶段"""
+    begin_phase(phase)
     try:
+        left = time_left()
+        timeout = None if left == float("inf") else max(left, 1)
         run(["git", "config", "--global", "user.email", "actions@github.com"])
         run(["git", "config", "--global", "user.name", "GitHub Actions"])
-        run(["git", "add", filepath], check=True)
+        run(["git", "add", *[p for p in filepaths if os.path.exists(p)]], check=True)
+        missing = [p for p in filepaths if not os.path.exists(p)]
+        if missing:
+            # 已删除的文件（如替换正式快照后的暂存快照）从索引中移除；从未提交过的忽略
+            run(["git", "rm", "--cached", "--quiet", "--ignore-unmatch", "--", *missing], check=True)
         run(["git", "commit", "-m", f"update snapshot {time.strftime('%Y-%m-%d %H:%M:%S')}"], check=True)
-        run(["git", "push", "origin", "main"], check=True)
+        if run(["git", "push", "origin", "main"], timeout=timeout).returncode != 0:
+            # 远端有新提交（如手动修改）时先变基再推送一次
+            try:
+                rebased = run(["git", "pull", "--rebase", "origin", "main"], timeout=timeout).returncode == 0
+            except TimeoutExpired:
+                rebased = False
+            if not rebased:
+                # 冲突或超时时放弃变基，回到本地提交；否则仓库停在变基中途，之后的提交都会失败
+                run(["git", "rebase", "--abort"], capture_output=True)
+                print("Git 变基失败，本地提交留待下次运行推送。")
+                return False
+            run(["git", "push", "origin", "main"], check=True, timeout=timeout)
+        return True
+    except TimeoutExpired:
+        print("Git 推送超时，本地修改留待下次运行提交。")
     except Exception as e:
         print("Git 推送失败：", e)
+    return False
 
 # --------------------------
 # 主流程
 # --------------------------
 
 def main():
+    global _DEADLINE
+    _DEADLINE = RunDeadline(RUN_DEADLINE)
+    if HTTP_REPLAY:
+        load_archive(HTTP_REPLAY)
+    load_breakers(BREAKER_FILE)
     try:
-        new_snapshot = fetch_all_modules()
+        run_watcher()
+    finally:
+        # 熔断状态变化但本次没有随快照提交时，单独保存并提交
+        if save_breakers(BREAKER_FILE):
+            git_commit_and_push(BREAKER_FILE)
+
+def run_watcher():
+    load_validators(VALIDATORS_FILE)
+    journal = load_journal(JOURNAL_FILE)
+    if journal["step"] != "done":
+        # 上次运行在发信或提交途中中断：按日志继续，不重新抓取比对，已发出的邮件不再重发
+        print(f"继续上次未完成的运行（{journal.get('run')}，步骤 {journal['step']}）。")
+        load_articles(ARTICLES_FILE)
+        finish_run(journal)
+        journal = load_journal(JOURNAL_FILE)
+    old_snapshot = load_snapshot(SNAPSHOT_FILE)
+    # 上次未能投递的更新先并入本次
+    updates, deliveries = undelivered(journal)
+    attempts = {key: m["attempts"] for key, m in journal["messages"].items()}
+    begin_phase("fetch")
+    try:
+        new_snapshot = fetch_all_modules(old_snapshot)
     except Exception as e:
         print("抓取失败：", e)
         return
+    print_run_stats()
 
-    old_snapshot = load_snapshot(SNAPSHOT_FILE)
-    diffs = diff_snapshots(old_snapshot, new_snapshot)
+    subject = f"[NUBS] 官网更新 ({time.strftime('%Y-%m-%d %H:%M:%S')})"
+    if new_snapshot is None:
+        if RUN_STATS["pages_failed"]:
+            print("抓取失败，保留上次快照。")
+        else:
+            print("页面未修改，跳过解析与比对。")
+        if deliveries:
+            retry = new_journal(subject, updates, deliveries, None, attempts)
+            save_journal(JOURNAL_FILE, retry)
+            finish_run(retry)
+        return
 
-    user_recipients = {}  # {邮箱: [模块更新文本]}
+    begin_phase("diff")
+    diffs = diff_snapshots(old_snapshot, new_snapshot)
+    if FETCH_ARTICLES:
+        load_articles(ARTICLES_FILE)
+        print(f"抓取文章详情：{fetch_article_details(diffs)} 篇")
 
+    run_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
     for mod, info in diffs.items():
         added, removed, changed = info['added'], info['removed'], info['changed']
-        if not (added or removed or changed):
+        if not (added or removed or changed) or not MODULE_SUBSCRIPTIONS.get(mod):
             continue
-
-        ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-        mod_summary = summarize_diffs({mod: info})
-        body = f"### {mod} 更新 ({ts}) ###\n{mod_summary}"
+        uid = f"{run_time} {mod}"
+        updates[uid] = {"module": mod, "time": run_time, "diff": diff_to_json(info)}
 
         # 找到订阅了这个模块的所有收件人
-        for recipient in MODULE_SUBSCRIPTIONS.get(mod, []):
-            user_recipients.setdefault(recipient, []).append(body)
-
-    if user_recipients:
-        subject = f"[NUBS] 官网更新 ({time.strftime('%Y-%m-%d %H:%M:%S')})"
-        send_email_combined(subject, user_recipients)
-        save_snapshot(SNAPSHOT_FILE, new_snapshot)
-        git_commit_and_push(SNAPSHOT_FILE)
+        for recipient in MODULE_SUBSCRIPTIONS[mod]:
+            deliveries.setdefault(recipient_key(recipient), []).append(uid)
+
+    if deliveries:
+        staged = stage_snapshot(SNAPSHOT_FILE, new_snapshot)
+        run_journal = new_journal(subject, updates, deliveries, staged, attempts)
+        # 先写运行日志与暂存快照并推送，再发信：之后任何一步中断，下次都能从日志继续而不重复发信
+        save_journal(JOURNAL_FILE, run_journal)
+        save_articles(ARTICLES_FILE)
+        if not git_commit_and_push(JOURNAL_FILE, staged, ARTICLES_FILE, phase="diff"):
+            print("运行日志未能提交，继续在本地按日志执行。")
+        finish_run(run_journal)
     else:
         if not old_snapshot:
             save_snapshot(SNAPSHOT_FILE, new_snapshot)
-            git_commit_and_push(SNAPSHOT_FILE)
+            save_validators(VALIDATORS_FILE)
+            save_breakers(BREAKER_FILE)
+            git_commit_and_push(*snapshot_files(SNAPSHOT_FILE), VALIDATORS_FILE, BREAKER_FILE)
             print("首次抓取并保存快照。")
         else:
+            # 内容与快照完全一致时才更新校验信息，避免无人订阅的变化被 304 掩盖
+            if not any(v for info in diffs.values() for v in info.values()):
+                save_validators(VALIDATORS_FILE)
             print("未检测到变化。")
 
+def simulate(archive_path):
+    """离线回放存档中按时间顺序录制的页面，逐次比对并打印变化（不发信、不写文件、不推送）"""
+    global HTTP_REPLAY
+    HTTP_REPLAY = archive_path
+    load_archive(archive_path)
+    snapshot = {}
+    # 回放次数以记录最多的 URL 为准
+    steps = max((len(records) for records in _REPLAY.values()), default=0)
+    for step in range(1, steps + 1):
+        new_snapshot = fetch_all_modules(snapshot)
+        if new_snapshot is None:
+            print(f"--- 第 {step} 次：未变化 ---")
+        elif not snapshot:
+            print(f"--- 第 {step} 次：首次快照 ---")
+        else:
+            summary = summarize_diffs(diff_snapshots(snapshot, new_snapshot))
+            print(f"--- 第 {step} 次 ---{summary or ' 未变化'}")
+        if new_snapshot is not None:
+            snapshot = new_snapshot
+    print_run_stats()
+    return snapshot
+
 
 if __name__ == "__main__":
-    main()
+    # python njubs.py replay <存档>：离线回放录制的响应序列
+    if len(sys.argv) == 3 and sys.argv[1] == "replay":
+        simulate(sys.argv[2])
+    # python njubs.py convert <源快照> <目标快照>：按扩展名在 JSON、SQLite、事件日志与分段快照之间转换
+    elif len(sys.argv) == 4 and sys.argv[1] == "convert":
+        convert_snapshot(sys.argv[2], sys.argv[3])
+    else:
+        main()
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+# njubs.py 是单文件脚本，不是安装的包：把仓库根目录加入导入路径
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
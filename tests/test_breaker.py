@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+重试与熔断测试：本地 ThreadingHTTPServer 按预设顺序返回状态码
+- 运行：python -m pytest tests
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import njubs
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    """依次返回 server.statuses 中的状态码，用完后一直返回最后一个"""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits += 1
+            status = server.statuses[min(server.hits, len(server.statuses)) - 1]
+        body = b"<html><body>ok</body></html>" if status == 200 else b"busy"
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    """返回 (服务器, 地址)；测试中设置 server.statuses"""
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ScriptedHandler)
+    httpd.statuses, httpd.hits, httpd.lock = [503], 0, threading.Lock()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd, f"http://127.0.0.1:{httpd.server_address[1]}/page.htm"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    """每个测试从空的熔断状态与统计开始，重试不等待"""
+    monkeypatch.setattr(njubs, "_BREAKERS", {})
+    monkeypatch.setattr(njubs, "RUN_STATS", dict.fromkeys(njubs.RUN_STATS, 0))
+    monkeypatch.setattr(njubs, "_DEADLINE", None)
+    monkeypatch.setattr(njubs, "RETRY_BACKOFF_BASE", 0.0)
+
+
+def test_retry_recovers_after_503(server):
+    httpd, url = server
+    httpd.statuses = [503, 503, 200]
+    page = njubs.get_page_raw(url)
+    assert b"ok" in page.content
+    assert httpd.hits == 3
+    assert njubs.RUN_STATS["retries"] == 2
+    assert "127.0.0.1" not in njubs._BREAKERS
+
+
+def test_breaker_opens_after_threshold(server):
+    httpd, url = server
+    for _ in range(njubs.BREAKER_THRESHOLD):
+        assert njubs.get_page_raw(url).content == b""
+    assert httpd.hits == njubs.BREAKER_THRESHOLD * (njubs.RETRY_ATTEMPTS + 1)
+    # 熔断后不再发出请求
+    assert njubs.get_page_raw(url).content == b""
+    assert httpd.hits == njubs.BREAKER_THRESHOLD * (njubs.RETRY_ATTEMPTS + 1)
+    assert njubs.RUN_STATS["breaker_rejected"] == 1
+
+
+def test_half_open_failure_doubles_cooldown(server, monkeypatch):
+    httpd, url = server
+    host = "127.0.0.1"
+    for _ in range(njubs.BREAKER_THRESHOLD):
+        njubs.get_page_raw(url)
+    first = njubs.breaker_cooldown(njubs._BREAKERS[host])
+    assert first == njubs.BREAKER_COOLDOWN
+    # 冷却期过后放行一次试探，仍然失败则冷却时间加倍
+    njubs._BREAKERS[host]["opened_at"] -= first
+    assert njubs.breaker_allows(host)
+    njubs.get_page_raw(url)
+    assert not njubs.breaker_allows(host)
+    assert njubs.breaker_cooldown(njubs._BREAKERS[host]) == min(2 * first, njubs.BREAKER_COOLDOWN_MAX)
+    # 试探成功则熔断状态清除
+    httpd.statuses = [200]
+    monkeypatch.setitem(njubs._BREAKERS[host], "opened_at", 0)
+    assert b"ok" in njubs.get_page_raw(url).content
+    assert host not in njubs._BREAKERS
+
+
+def test_cooldown_outlasts_cron_interval():
+    # 工作流每 30 分钟运行一次，冷却期不长于此时每次运行都会试探，熔断形同虚设
+    assert njubs.BREAKER_COOLDOWN > 30 * 60